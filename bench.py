@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+import typing as T
+import argparse
+import dataclasses as dc
+import functools
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from common import Insn, Expr, Arg, AExpr, Binop, Unop, Call, Index, Ys7Scp
+import main
+import synth
+
+# Times each conversion main.py performs on generated inputs, and compares the
+# results against a stored baseline.
+
+sizes = {
+	"small": 10,
+	"medium": 50,
+	"large": 200,
+}
+
+Prepared: T.TypeAlias = tuple[T.Callable[[], T.Any], int, int] # the function to time, and its input's size and item count
+
+@dc.dataclass
+class Case:
+	name: str
+	make: T.Callable[[Path, str], tuple[Path, int]] # returns the input file and its item count
+	parser: str = "lark"
+
+	def prepare(self, dir: Path, size: str) -> Prepared:
+		dir.mkdir(parents=True)
+		file, items = self.make(dir, size)
+		outfile = dir / "out"
+		return lambda: main.convert_file(None, file, outfile, None, self.parser), file.stat().st_size, items
+
+@dc.dataclass
+class Micro:
+	# Times one function on an in-memory input, rather than a whole conversion
+	name: str
+	make: T.Callable[[int], Prepared] # takes the scale from sizes
+
+	def prepare(self, dir: Path, size: str) -> Prepared:
+		return self.make(sizes[size])
+
+@dc.dataclass
+class Result:
+	case: str
+	size: str
+	bytes: int
+	items: int
+	seconds: float
+	peak: int
+	retained: int # still allocated once the function returns, with its result alive
+
+	@property
+	def retained_item(self) -> float:
+		return self.retained / self.items
+
+	@property
+	def key(self) -> str:
+		return f"{self.case}/{self.size}"
+
+	@property
+	def mb_s(self) -> float:
+		return self.bytes / self.seconds / 1e6
+
+	@property
+	def items_s(self) -> float:
+		return self.items / self.seconds
+
+def count(code: list[Insn]) -> int:
+	return sum(1 + count(insn.body or []) for insn in code)
+
+def make_script(dir: Path, size: str, version: int) -> tuple[Path, int]:
+	params = synth.Params(version=version, functions=sizes[size])
+	path, = synth.write_corpus(params, dir / f"script_{size}", 1)
+	return path, sum(count(code) for _, code in synth.generate(params, "0:0").functions)
+
+def make_text(dir: Path, size: str, version: int) -> tuple[Path, int]:
+	path, n = make_script(dir, size, version)
+	return path.with_suffix(".7l"), n
+
+def make_nested(dir: Path, size: str, version: int) -> tuple[Path, int]:
+	# A single function nested as deep as it gets, to catch superlinear encoding
+	depth = sizes[size] * 4
+	body = [Insn("Wait", [1])]
+	for i in range(depth):
+		body = [Insn("if", [AExpr(Binop(Index("FLAG", i), "==", 1))], body), Insn("else", [], [Insn("Wait", [i])]), Insn("Wait", [0])]
+	import print_bin
+	path = dir / f"nested_{size}.bin"
+	path.write_bytes(print_bin.write_ys7_scp(Ys7Scp(version, bytes(8), [("nested", body)])))
+	return path, depth * 3 + 1
+
+def make_scp(dir: Path, size: str) -> tuple[Path, int]:
+	r = random.Random(size)
+	n = sizes[size] * 200
+	strings = []
+	for i in range(n):
+		strings.append(f"#{i:05}")
+		strings.append(" ".join(r.choices(["Adol", "Dana", "アドル", "island", "\"ship\"", "ruins,"], k=r.randrange(1, 12))))
+	path = dir / f"text_{size}.scp"
+	path.write_bytes(("\0".join(strings) + "\0\t").encode("utf8"))
+	return path, n
+
+def make_json(dir: Path, size: str) -> tuple[Path, int]:
+	r = random.Random(size)
+	n = sizes[size] * 100
+	fields = [{ "type": t, "unk": False } for t in ["int", "str", "int", "int", "str"]]
+	rows = [
+		[r.randrange(1 << 31), f"name_{r.randrange(n)}", i, r.randrange(100), r.choice(["", "アイテム", "item"])]
+		for i in range(n)
+	]
+	path = dir / f"table_{size}.dbin.json"
+	path.write_text(json.dumps({ "kind": "ITEM", "fields": fields, "rows": rows }, ensure_ascii=False), encoding="utf8")
+	return path, n
+
+def converted(make: T.Callable[[Path, str], tuple[Path, int]]) -> T.Callable[[Path, str], tuple[Path, int]]:
+	# Uses the output of another conversion as input
+	def f(dir: Path, size: str) -> tuple[Path, int]:
+		path, n = make(dir, size)
+		file, suffix = main.output_name(path)
+		outfile = file.with_suffix(suffix)
+		main.convert_file(None, path, outfile)
+		return outfile, n
+	return f
+
+def nodes(e: Expr) -> int:
+	match e:
+		case Binop(a, _, b): return 1 + nodes(a) + nodes(b)
+		case Unop(_, a) | Index(_, a): return 1 + nodes(a)
+		case Call(name, args): return (name != "expr_missing") + sum(map(nodes, args))
+		case _: return 1
+
+def nest(n: int, wrap: T.Callable[[Expr], Expr]) -> Expr:
+	e: Expr = 1
+	for _ in range(n):
+		e = wrap(e)
+	return e
+
+# Expressions made almost entirely of one kind of opcode
+expr_kinds: dict[str, T.Callable[[int], Expr]] = {
+	"int": lambda n: Call("expr_missing", list(range(n))),
+	"float": lambda n: Call("expr_missing", [i + 0.5 for i in range(n)]),
+	"chr": lambda n: Call("expr_missing", ["abc"] * n),
+	"unop": lambda n: nest(n, lambda e: Unop("!", e)),
+	"binop": lambda n: nest(n, lambda e: Binop(e, "+", 2)),
+	"index": lambda n: nest(n, lambda e: Index("FLAG", e)),
+	"func": lambda n: nest(n, lambda e: Call("sin", [e])),
+}
+
+def make_exprs(kind: str, scale: int) -> Prepared:
+	import read, parse_bin, print_bin
+	e = expr_kinds[kind](50)
+	raw = print_bin.write_expr(e)
+	assert parse_bin.parse_expr(read.Reader(raw)) == e
+	raws = [raw] * (scale * 20)
+	def f() -> None:
+		for raw in raws:
+			parse_bin.parse_expr(read.Reader(raw))
+	return f, len(raw) * len(raws), nodes(e) * len(raws)
+
+arg_kinds: dict[str, Arg] = {
+	"i32": 1,
+	"f32": 1.5,
+	"str": "abc",
+	"expr": AExpr(Binop(Index("FLAG", 3), "==", 1)),
+	"lines": ["ab", "cd"],
+}
+
+def make_args(kind: str, scale: int) -> Prepared:
+	import common, read, parse_bin, print_bin
+	insns = common.insn_tables[16]
+	n = scale * 100
+	data = bytes(print_bin.write_insn("Wait", [arg_kinds[kind]] * 8, common.compile_table(insns).opcodes)) * n
+	def f() -> None:
+		r = read.Reader(data)
+		while r.remaining:
+			parse_bin.parse_insn(r, insns)
+	return f, len(data), n * 8
+
+def make_reader(scale: int) -> Prepared:
+	import read
+	n = scale * 1000
+	data = bytes(range(256)) * (n * 14 // 256 + 1)
+	def f() -> None:
+		r = read.Reader(data)
+		for _ in range(n):
+			r.u16(); r.u32(); r.i32(); r.f32()
+	return f, n * 14, n * 4
+
+def make_writer(scale: int) -> Prepared:
+	import read
+	n = scale * 1000
+	def f() -> None:
+		w = read.Writer()
+		for _ in range(n):
+			w.u16(1); w.u32(2); w.i32(-3); w.f32(0.5)
+		bytes(w)
+	return f, n * 14, n * 4
+
+def make_decoded(scale: int, version: int) -> Prepared:
+	# Keeps the decoded script, so that kept/item is the size of the AST
+	import parse_bin, print_bin
+	params = synth.Params(version=version, functions=scale)
+	scp = synth.generate(params, "0:0")
+	data = print_bin.write_ys7_scp(scp)
+	return lambda: parse_bin.parse_ys7_scp(data), len(data), sum(count(code) for _, code in scp.functions)
+
+def cases(version: int) -> list[Case | Micro]:
+	return [
+		Case(".bin→.7l", functools.partial(make_script, version=version)),
+		Case(".7l→.bin", functools.partial(make_text, version=version)),
+		Case(".7l→.bin rd", functools.partial(make_text, version=version), "rd"),
+		Case(".bin→.7l nested", functools.partial(make_nested, version=version)),
+		Case(".7l→.bin nested", converted(functools.partial(make_nested, version=version)), "rd"),
+		Case(".scp→.csv", make_scp),
+		Case(".csv→.scp", converted(make_scp)),
+		Case(".dbin.json→.dbin", make_json),
+		Case(".dbin→.dbin.json", converted(make_json)),
+		Micro("decoded AST", functools.partial(make_decoded, version=version)),
+		Micro("Reader fields", make_reader),
+		Micro("Writer fields", make_writer),
+		*[Micro(f"expr {kind}", functools.partial(make_exprs, kind)) for kind in expr_kinds],
+		*[Micro(f"arg {kind}", functools.partial(make_args, kind)) for kind in arg_kinds],
+	]
+
+def run(case: Case | Micro, size: str, dir: Path, repeat: int) -> Result:
+	func, nbytes, items = case.prepare(dir / case.name.replace("→", "-").replace(" ", "_"), size)
+
+	func() # warm up imports and caches
+	seconds = min(timed(func) for _ in range(repeat))
+
+	tracemalloc.start()
+	out = func()
+	retained, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del out
+
+	return Result(case.name, size, nbytes, items, seconds, peak, retained)
+
+def timed(f: T.Callable[[], T.Any]) -> float:
+	start = time.perf_counter()
+	f()
+	return time.perf_counter() - start
+
+def compare(result: Result, baseline: dict[str, T.Any], threshold: float) -> list[str]:
+	if result.key not in baseline:
+		return []
+	base = baseline[result.key]
+	out = []
+	if result.mb_s < base["mb_s"] * (1 - threshold):
+		out.append(f"throughput {base['mb_s']:.2f} → {result.mb_s:.2f} MB/s")
+	if result.peak > base["peak"] * (1 + threshold):
+		out.append(f"peak memory {base['peak']/2**20:.1f} → {result.peak/2**20:.1f} MiB")
+	if "retained" in base and result.retained > base["retained"] * (1 + threshold):
+		out.append(f"retained memory {base['retained']/2**20:.1f} → {result.retained/2**20:.1f} MiB")
+	return out
+
+# main.py imports the conversion modules only when a file needs them, so that
+# decompiling doesn't pay for loading the compiler or the .7l grammar
+lazy_modules = ["print_bin", "parse_text", "parse_text_rd", "grammar", "concurrent.futures"]
+
+def check_imports(dir: Path, version: int) -> list[str]:
+	dir.mkdir(parents=True)
+	file, _ = make_script(dir, "small", version)
+	code = "import sys, main; from pathlib import Path; main.convert_file(None, Path(sys.argv[1]), Path(sys.argv[2])); print(*sys.modules)"
+	out = subprocess.run([sys.executable, "-c", code, file, dir / "out.7l"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True)
+	loaded = set(out.stdout.split())
+	return [name for name in lazy_modules if name in loaded]
+
+argp = argparse.ArgumentParser(description="benchmark each conversion on generated inputs")
+argp.add_argument("-k", "--repeat", help="timed runs per benchmark; the fastest is reported", type = int, default = 5)
+argp.add_argument("-s", "--size", help="input sizes to run", choices = list(sizes), action = "append")
+argp.add_argument("-c", "--case", help="only run benchmarks whose name contains this", action = "append")
+argp.add_argument("-v", "--version", help="script version to generate", type = int, choices = [2, 6, 16], default = 16)
+argp.add_argument("--baseline", help="baseline file to compare against", type = Path, default = Path(__file__).parent / "bench_baseline.json")
+argp.add_argument("--save", help="store the results as the new baseline", action = "store_true")
+argp.add_argument("--threshold", help="relative slowdown or memory growth counted as a regression", type = float, default = 0.2)
+
+def __main__(repeat: int, size: list[str] | None, case: list[str] | None, version: int, baseline: Path, save: bool, threshold: float) -> int:
+	sys.setrecursionlimit(10000)
+	baseline_data = json.loads(baseline.read_text(encoding="utf8")) if baseline.exists() else {}
+
+	results = []
+	regressions = 0
+	print(f"{'benchmark':28} {'input':>9} {'time':>9} {'MB/s':>7} {'items/s':>9} {'peak':>9} {'kept/item':>9}")
+	with tempfile.TemporaryDirectory() as tmp:
+		if loaded := check_imports(Path(tmp) / "imports", version):
+			print(f"  regression: decompiling a .bin imports {', '.join(loaded)}")
+			regressions += 1
+		for size_ in size or list(sizes):
+			for c in cases(version):
+				if case and not any(name in c.name for name in case):
+					continue
+				r = run(c, size_, Path(tmp) / size_, repeat)
+				results.append(r)
+				items = f"{r.items_s:9.0f}" if not c.name.startswith((".scp", ".csv", ".dbin")) else f"{'':9}"
+				print(f"{r.key:28} {r.bytes/1e3:7.0f}kB {r.seconds*1e3:7.1f}ms {r.mb_s:7.2f} {items} {r.peak/2**20:6.1f}MiB {r.retained_item:8.0f}B", flush=True)
+				for problem in compare(r, baseline_data, threshold) if not save else []:
+					print(f"  regression: {problem}")
+					regressions += 1
+
+	if save:
+		baseline_data.update((r.key, { "mb_s": r.mb_s, "items_s": r.items_s, "peak": r.peak, "retained": r.retained }) for r in results)
+		baseline.write_text(json.dumps(baseline_data, indent="\t", ensure_ascii=False) + "\n", encoding="utf8")
+		print(f"saved baseline to {baseline}")
+	elif baseline_data:
+		print(f"{regressions} regressions against {baseline} (threshold {threshold:.0%})")
+	return 1 if regressions else 0
+
+if __name__ == "__main__":
+	sys.exit(__main__(**argp.parse_args().__dict__))
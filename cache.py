@@ -0,0 +1,75 @@
+from __future__ import annotations
+import dataclasses as dc
+import functools
+import hashlib
+import filecmp
+import shutil
+import os
+from pathlib import Path
+
+__all__ = ["Cache"]
+
+# The modules that can change a conversion's output; editing anything else,
+# like the benchmarks, shouldn't invalidate the cache
+tool_modules = ["common", "read", "parse_bin", "print_bin", "print_text", "parse_text", "parse_text_rd", "grammar", "dbin", "settings", "main"]
+
+@functools.cache
+def tool_digest() -> bytes:
+	root = Path(__file__).parent
+	h = hashlib.sha256()
+	for path in sorted([*(root / f"{name}.py" for name in tool_modules), root / "grammar.g", *root.glob("insn/*.txt")]):
+		h.update(path.name.encode() + b"\0")
+		h.update(path.read_bytes())
+	return h.digest()
+
+@dc.dataclass
+class Cache:
+	root: Path
+	max_size: int
+
+	def __post_init__(self) -> None:
+		self.root.mkdir(parents=True, exist_ok=True)
+
+	def key(self, *parts: bytes | str) -> str:
+		h = hashlib.sha256(tool_digest())
+		for part in parts:
+			if isinstance(part, str):
+				part = part.encode()
+			h.update(len(part).to_bytes(8, "little"))
+			h.update(part)
+		return h.hexdigest()
+
+	def fetch(self, key: str, outfile: Path) -> bool:
+		entry = self.root / key
+		try:
+			os.utime(entry)
+			if not (outfile.exists() and filecmp.cmp(entry, outfile, shallow=False)):
+				shutil.copyfile(entry, outfile)
+		except FileNotFoundError:
+			return False
+		return True
+
+	def store(self, key: str, outfile: Path) -> None:
+		entry = self.root / key
+		tmp = entry.with_name(f"{key}.{os.getpid()}.tmp")
+		shutil.copyfile(outfile, tmp)
+		os.replace(tmp, entry)
+		self.evict()
+
+	def evict(self) -> None:
+		entries = []
+		for path in self.root.iterdir():
+			if path.suffix == ".tmp":
+				continue
+			try:
+				st = path.stat()
+			except FileNotFoundError:
+				continue
+			entries.append((st.st_mtime_ns, st.st_size, path))
+		entries.sort(reverse=True)
+
+		size = 0
+		for _, n, path in entries:
+			size += n
+			if size > self.max_size:
+				path.unlink(missing_ok=True)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+import typing as T
+import argparse
+import math
+import random
+import struct
+import sys
+
+import print_text
+
+# Checks print_text.print_float against the plain search it replaced, on edge
+# cases and random f32s. The fast path skips precisions it assumes can't
+# round-trip, so run this after touching it.
+
+_F32 = struct.Struct("f")
+
+def reference(f: float) -> str:
+	for i in range(50):
+		s = f"{f:.{i}f}"
+		if struct.pack("f", f) == struct.pack("f", float(s)):
+			return s
+	raise ValueError(f"no repr for {f}")
+
+def outcome(func: T.Callable[[float], str], f: float) -> str | tuple[type, str]:
+	try:
+		return func(f)
+	except Exception as e:
+		return type(e), str(e)
+
+def edge_cases() -> list[float]:
+	out = [0.0, -0.0, math.inf, -math.inf, math.nan, 0.5, 1.0, 10.0, 0.1, 0.3, 1e-5]
+	out += [1e-300, -1e-300, 1e300, 3.4028235e38, 3.4028236e38, 1e-45, 1.4e-45, 7e-46]
+	for i in range(-45, 39):
+		out += [10.0**i, -10.0**i, _F32.unpack(_F32.pack(10.0**i))[0]]
+	return out
+
+def random_values(r: random.Random, n: int) -> T.Iterator[float]:
+	for k in range(n):
+		match k % 4:
+			case 0: # short decimals, like most floats in scripts
+				yield _F32.unpack(_F32.pack(r.randrange(-10**6, 10**6) / 10**r.randrange(7)))[0]
+			case 1: # doubles that don't fit in an f32
+				yield r.uniform(-1, 1) * 10.0**r.randrange(-320, 300)
+			case _: # any f32 bit pattern
+				yield _F32.unpack(r.getrandbits(32).to_bytes(4, "little"))[0]
+
+argp = argparse.ArgumentParser(description="check print_float against the reference algorithm")
+argp.add_argument("-n", "--count", help="number of random values to check", type = int, default = 100000)
+argp.add_argument("-s", "--seed", help="random seed", type = int, default = 0)
+
+def __main__(count: int, seed: int) -> int:
+	mismatches = 0
+	values = [*edge_cases(), *random_values(random.Random(seed), count)]
+	for f in values:
+		a, b = outcome(reference, f), outcome(print_text.print_float, f)
+		if a != b:
+			print(f"{f!r}: expected {a!r}, got {b!r}")
+			mismatches += 1
+	print(f"{mismatches} mismatches in {len(values)} values")
+	return 1 if mismatches else 0
+
+if __name__ == "__main__":
+	sys.exit(__main__(**argp.parse_args().__dict__))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+import argparse
+import sys
+
+import parse_text, parse_text_rd
+import synth
+from common import insn_tables
+
+# Checks that parse_text_rd gives the same result as the Lark grammar, on edge
+# cases and generated scripts. Results are also compared by repr, since
+# 1 == 1.0 would hide a number parsed as the wrong type.
+
+valid = [
+	'version 2 hash "00"',
+	'version 16 hash "0102030405060708"\n// comment\nfunction "a" { }',
+	'''version 6 hash "AA" function "f""x" {
+	X() Y(1, -2, 3.5, -4.25, "s""q", {"a" "b"}, {}, ) // trailing
+	if((-5 * 2 - -3 - 4)) { Z((!-5)) } elif((- 5)) {} else() {
+	W((FLAG[1] == 2 && WORK[3] != 4 || 5 < 6 & 7 > 8 | 9 <= 10 && 11 >= 12))
+	}
+	V((abs(1, 2,) + sin() * 3 / 4 % 5), ("a"."b"."c" + "x"), ("s".-1), (!!1), (1 expr_missing_op 2 expr_missing_op 3))
+	V(((1 + 2) * (3 - 4)), (-(1)), (--1), (-1.5--2.5), (a(b(c[d(e[1])]))))
+	U(0, 00, 007, 1.0, -0, -0.0)
+}
+function "g" { ttt() {} }''',
+]
+
+invalid = [
+	'version 2.5 hash "00"',
+	'version 2 hash "00" $',
+	'version 2 hash "00" function "f" { X(,) }',
+	'version 2 hash "00" function "f" { X((1 = 2)) }',
+	'version 2 hash "00" function "f" { X((1 +)) }',
+	'version 2 hash "00" function "f" { X(1 2) }',
+	'version 2 hash "00" function "f" { X(1) ',
+	'version 2 hash "00" function "f" { X(',
+	'version 2 hash "00" function "f" { X((a)) }',
+]
+
+def generated(files: int, seed: int) -> list[tuple[str, str]]:
+	import parse_bin, print_bin, print_text
+	out = []
+	for version in sorted(insn_tables):
+		params = synth.Params(version=version, functions=10)
+		for i in range(files):
+			# Through .bin, so the text is what main.py would produce
+			data = print_bin.write_ys7_scp(synth.generate(params, f"{seed}:{i}"))
+			out.append((f"synth{version}_{seed}_{i:03}", print_text.print_ys7_scp(parse_bin.parse_ys7_scp(data))))
+	return out
+
+def check(name: str, src: str, ok: bool = True) -> str | None:
+	try:
+		a = parse_text.parse_ys7_scp(src)
+	except Exception as e:
+		a = e
+	try:
+		b = parse_text_rd.parse_ys7_scp(src)
+	except ValueError as e:
+		b = e
+	except Exception as e:
+		return f"{name}: rd raised {e!r} instead of ValueError"
+	if isinstance(a, Exception) or isinstance(b, Exception):
+		if isinstance(a, Exception) != isinstance(b, Exception):
+			return f"{name}: lark gave {a!r}, rd gave {b!r}"
+		return f"{name}: both parsers rejected it: {b}" if ok else None
+	if not ok:
+		return f"{name}: both parsers accepted it"
+	if a != b or repr(a) != repr(b):
+		return f"{name}: results differ"
+	return None
+
+argp = argparse.ArgumentParser(description="check parse_text_rd against the Lark parser")
+argp.add_argument("-n", "--files", help="number of generated scripts per version", type = int, default = 5)
+argp.add_argument("-s", "--seed", help="random seed", type = int, default = 0)
+
+def __main__(files: int, seed: int) -> int:
+	sys.setrecursionlimit(10000)
+	inputs = [
+		*((f"valid {i}", src, True) for i, src in enumerate(valid)),
+		*((f"invalid {i}", src, False) for i, src in enumerate(invalid)),
+		*((name, src, True) for name, src in generated(files, seed)),
+	]
+	mismatches = 0
+	for name, src, ok in inputs:
+		if (problem := check(name, src, ok)) is not None:
+			print(problem)
+			mismatches += 1
+	print(f"{mismatches} mismatches in {len(inputs)} inputs")
+	return 1 if mismatches else 0
+
+if __name__ == "__main__":
+	sys.exit(__main__(**argp.parse_args().__dict__))
@@ -1,40 +1,93 @@
 from __future__ import annotations
 import typing as T
 import dataclasses as dc
+import functools
+import marshal
+import os
 from pathlib import Path
 
-@dc.dataclass
+@dc.dataclass(slots=True)
 class Binop:
 	a: Expr
 	op: str
 	b: Expr
 
-@dc.dataclass
+@dc.dataclass(slots=True)
 class Unop:
 	op: str
 	a: Expr
 
-@dc.dataclass
+@dc.dataclass(slots=True)
 class Call:
 	name: str
 	args: list[Expr]
 
-@dc.dataclass
+@dc.dataclass(slots=True)
 class Index:
 	name: str
 	body: Expr
 
 Expr: T.TypeAlias = int | str | float | Binop | Unop | Call | Index
 
-@dc.dataclass
+@dc.dataclass(slots=True)
 class Insn:
 	name: str
 	args: list[Arg] = dc.field(default_factory=list)
 	body: list[Insn] | None = None
+	# Offsets of the start and end of the instruction, when read from a .bin
+	startpos: int | None = dc.field(default=None, repr=False, compare=False, kw_only=True)
+	pos: int | None = dc.field(default=None, repr=False, compare=False, kw_only=True)
 
-@dc.dataclass
 class AExpr:
-	expr: Expr
+	# When read from a .bin, the expression is kept encoded in raw and decoded
+	# the first time expr is accessed; until then, print_bin writes the bytes
+	# back unchanged.
+	__slots__ = ("_expr", "raw")
+	__match_args__ = ("expr",)
+	_expr: Expr
+	raw: bytes | None
+
+	def __init__(self, expr: Expr):
+		self._expr = expr
+		self.raw = None
+
+	@classmethod
+	def from_bytes(cls, raw: bytes) -> AExpr:
+		self = cls.__new__(cls)
+		self._expr = 0
+		self.raw = raw
+		return self
+
+	@property
+	def expr(self) -> Expr:
+		if self.raw is not None:
+			self._expr = self._peek()
+			self.raw = None
+		return self._expr
+
+	@expr.setter
+	def expr(self, expr: Expr) -> None:
+		self._expr = expr
+		self.raw = None
+
+	def _peek(self) -> Expr:
+		# Decodes without dropping raw, for comparisons and reprs
+		if self.raw is None:
+			return self._expr
+		import read, parse_bin
+		return parse_bin.parse_expr(read.Reader(self.raw))
+
+	def __repr__(self) -> str:
+		return f"{type(self).__name__}(expr={self._peek()!r})"
+
+	def __eq__(self, other: object) -> bool:
+		if not isinstance(other, AExpr):
+			return NotImplemented
+		if self.raw is not None and self.raw == other.raw:
+			return True
+		return self._peek() == other._peek()
+
+	__hash__ = None # type: ignore
 
 Arg: T.TypeAlias = int | float | str | AExpr | list[str]
 
@@ -57,23 +110,87 @@ def insn_table(path: str|Path) -> InsnTable:
 			case _: raise ValueError(line)
 	return insns
 
-NAYUTA = insn_table(Path(__file__).parent / "insn/nayuta.txt")
-YS7 = insn_table(Path(__file__).parent / "insn/ys7.txt")
-YS8 = insn_table(Path(__file__).parent / "insn/ys8.txt")
-YS9 = insn_table(Path(__file__).parent / "insn/ys9.txt")
-
-named_tables = {
-	"nayuta": NAYUTA,
-	"ys7": YS7,
-	"ys8": YS8,
-	"ys9": YS9,
+builtin_paths = {
+	"nayuta": Path(__file__).parent / "insn/nayuta.txt",
+	"ys7": Path(__file__).parent / "insn/ys7.txt",
+	"ys8": Path(__file__).parent / "insn/ys8.txt",
+	"ys9": Path(__file__).parent / "insn/ys9.txt",
 }
 
-insn_tables = {
-	2: NAYUTA,
-	6: YS8,
-	16: YS9,
-}
+@functools.cache
+def builtin_table(name: str) -> InsnTable:
+	# The parsed table is kept in insn/__pycache__, keyed on the text file's size and mtime
+	path = builtin_paths[name]
+	compiled = path.parent / "__pycache__" / f"{path.stem}.marshal"
+	st = path.stat()
+	stamp = (st.st_size, st.st_mtime_ns)
+	try:
+		cached_stamp, insns = marshal.loads(compiled.read_bytes())
+		if cached_stamp == stamp:
+			return insns
+	except (OSError, EOFError, ValueError, TypeError):
+		pass
+
+	insns = insn_table(path)
+	try:
+		compiled.parent.mkdir(exist_ok=True)
+		tmp = compiled.with_name(f"{compiled.name}.{os.getpid()}.tmp")
+		tmp.write_bytes(marshal.dumps((stamp, insns)))
+		os.replace(tmp, compiled)
+	except OSError:
+		pass
+	return insns
+
+K = T.TypeVar("K")
+class LazyTables(T.Mapping[K, InsnTable]):
+	def __init__(self, names: dict[K, str]):
+		self.names = names
+
+	def __getitem__(self, key: K) -> InsnTable:
+		return builtin_table(self.names[key])
+
+	def __iter__(self) -> T.Iterator[K]:
+		return iter(self.names)
+
+	def __len__(self) -> int:
+		return len(self.names)
+
+named_tables = LazyTables({ name: name for name in builtin_paths })
+
+insn_tables = LazyTables({
+	2: "nayuta",
+	6: "ys8",
+	16: "ys9",
+})
+
+def __getattr__(name: str) -> InsnTable:
+	if name in {"NAYUTA", "YS7", "YS8", "YS9"}:
+		return builtin_table(name.lower())
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class OpcodeTable(dict[str, int]):
+	def __missing__(self, name: str) -> int:
+		if not name.startswith("op_"):
+			raise KeyError(name)
+		op = self[name] = int(name[3:], 16)
+		return op
+
+@dc.dataclass(frozen=True, eq=False)
+class CompiledTable:
+	insns: InsnTable
+	opcodes: OpcodeTable
+
+_compiled_tables: dict[int, CompiledTable] = {}
+
+def compile_table(insns: InsnTable) -> CompiledTable:
+	# Keyed on identity; the entry keeps the table alive so the id can't be reused
+	table = _compiled_tables.get(id(insns))
+	if table is None:
+		if len(_compiled_tables) >= 16:
+			_compiled_tables.clear()
+		opcodes = OpcodeTable({ v: k for k, v in insns.items() })
+		table = _compiled_tables[id(insns)] = CompiledTable(insns, opcodes)
+	return table
 
 A = T.TypeVar("A")
 def diff(a: A, b: A):
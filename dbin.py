@@ -11,7 +11,7 @@ def parse_dbin(data: bytes) -> str:
 	f.check_u16(4)
 	f.check_u16(16)
 	f.check_u64(4)
-	p = [f.u32() for _ in range(6)]
+	p = f.unpack("6I")
 	f.check_u32(1)
 	f.check(bytes(16))
 	assert not f.remaining
@@ -36,13 +36,13 @@ def parse_dbin(data: bytes) -> str:
 
 	f = f.at(p[4])
 	strings = {}
-	for _ in range(p[5]):
-		v = f.pos - p[4]
-		s = f.zstr()
+	v = 0
+	for s in f.zstrs(p[5]):
 		try:
 			strings[v] = s.decode("utf8")
 		except UnicodeError:
 			strings[v] = "SJIS:"+s.decode("cp932")
+		v += len(s) + 1
 	assert len(strings) == len(set(strings))
 	f.check(bytes(len(f)-64-f.pos))
 
@@ -113,9 +113,9 @@ def parse_json(data: str) -> bytes:
 	p = [
 		len(data["rows"]),
 		len(data["fields"]) * 4,
-		len(rows.data),
+		len(rows),
 		len(data["fields"]),
-		len(rows.data) + len(fields.data),
+		len(rows) + len(fields),
 		len(string_pos),
 	]
 
@@ -130,4 +130,4 @@ def parse_json(data: str) -> bytes:
 	tail.u32(1)
 	tail.write(bytes(16))
 
-	return rows.data + fields.data + strings.data + tail.data
+	return bytes(rows) + bytes(fields) + bytes(strings) + bytes(tail)
@@ -1,34 +1,53 @@
 #!/usr/bin/env python3
+from __future__ import annotations
 import typing as T
 from sys import stderr, exit
 import os
 import argparse
-import csv
+import contextlib
+import functools
 from pathlib import Path
+import settings
 from common import InsnTable, insn_table, named_tables
-import parse_bin, print_text, parse_text, print_bin
-import dbin
+
+# The conversion modules are imported where they're used, so that for example
+# decompiling a .bin never loads the .7l grammar.
+if T.TYPE_CHECKING:
+	from concurrent.futures import Executor
+	from cache import Cache
+	from timing import FileProfile
 
 argp = argparse.ArgumentParser()
 argp.add_argument("-q", "--quiet", help="don't write status messages", action = "store_true")
 argp.add_argument("-i", "--insn", help="path to instruction table")
 argp.add_argument("-o", "--output", help="file or directory to place files in", type = Path)
 argp.add_argument("-e", "--encoding", help="text encoding to use in binary files")
+argp.add_argument("-j", "--jobs", help="number of files to convert in parallel, 0 for one per CPU", type = int, default = 1)
+argp.add_argument("--per-function", help="with -j, split each script's functions across the workers instead of whole files", action = "store_true")
+argp.add_argument("--cache", help="reuse outputs of unchanged inputs from this directory", type = Path, nargs = "?", const = Path(".septluxian-cache"))
+argp.add_argument("--cache-size", help="maximum size of the cache in MiB", type = int, default = 512)
+argp.add_argument("--parser", help="parser to use for .7l files: lark (the reference grammar), or rd (faster)", choices = ["lark", "rd"], default = "lark")
+argp.add_argument("--verify-roundtrip", help="instead of converting, check that .bin files decompile and recompile to the same bytes", action = "store_true")
+argp.add_argument("--profile", help="report time and memory spent in each stage of each conversion", action = "store_true")
+argp.add_argument("--profile-dump", help="with --profile, write cProfile stats for this many of the slowest files, beside their outputs", type = int, default = 0, metavar = "N")
 argp.add_argument("files", metavar="file", nargs="+", help="files to convert", type = Path)
 
-def __main__(quiet: bool, insn: str | None, output: Path | None, files: list[Path], encoding: str | None) -> int:
+def __main__(quiet: bool, insn: str | None, output: Path | None, files: list[Path], encoding: str | None, jobs: int, per_function: bool, cache: Path | None, cache_size: int, parser: str, verify_roundtrip: bool, profile: bool, profile_dump: int) -> int:
 	if output is None:
-		make_output = lambda path, suffix: path.with_suffix(suffix)
+		make_output = output_beside
 	elif len(files) == 1 and not output.is_dir():
-		make_output = lambda path, suffix: output
+		make_output = functools.partial(output_file, output)
 	else:
 		output.mkdir(parents=True, exist_ok=True)
-		make_output = lambda path, suffix: output / path.with_suffix(suffix).name
+		make_output = functools.partial(output_dir, output)
 
 	if encoding is not None:
-		import settings
 		settings.ENCODING = encoding
 
+	if cache is not None:
+		from cache import Cache
+		cache = Cache(cache, cache_size << 20)
+
 	if insn is None:
 		insns = None
 	elif a := named_tables.get(insn):
@@ -37,51 +56,207 @@ def __main__(quiet: bool, insn: str | None, output: Path | None, files: list[Pat
 		insns = insn_table(insn)
 
 	failed = False
-	for file in files:
-		if not quiet: print(f"{file} → ", file=stderr, end="", flush=True)
-		try:
-			outfile = process_file(make_output, insns, file)
-		except Exception as e:
-			if not quiet:
-				import traceback
-				traceback.print_exc()
-				print(e, file=stderr)
-			failed = True
+	with contextlib.ExitStack() as stack:
+		if jobs == 1:
+			submit = functools.partial
+		else:
+			from concurrent.futures import ProcessPoolExecutor
+			pool = stack.enter_context(ProcessPoolExecutor(jobs or None, initializer=init_worker, initargs=(settings.ENCODING,)))
+			submit = lambda *args: pool.submit(*args).result
+
+		if verify_roundtrip:
+			results = [(file, submit(verify_file, insns, file)) for file in files]
+		elif profile and per_function and jobs != 1:
+			results = [(file, functools.partial(profile_file, profile_dump > 0, make_output, insns, file, pool, cache, parser)) for file in files]
+		elif profile:
+			results = [(file, submit(profile_file, profile_dump > 0, make_output, insns, file, None, cache, parser)) for file in files]
+		elif per_function and jobs != 1:
+			results = [(file, functools.partial(process_file, make_output, insns, file, pool, cache, parser)) for file in files]
 		else:
-			if not quiet: print(f"{outfile}", file=stderr)
+			results = [(file, submit(process_file, make_output, insns, file, None, cache, parser)) for file in files]
+
+		profiles = []
+		for file, result in results:
+			if not quiet: print(f"{file} → ", file=stderr, end="", flush=True)
+			try:
+				outfile = result()
+				if profile:
+					outfile, file_profile = outfile
+					profiles.append(file_profile)
+			except RoundtripError as e:
+				if not quiet: print(e, file=stderr)
+				failed = True
+			except Exception as e:
+				if not quiet:
+					import traceback
+					traceback.print_exc()
+					print(e, file=stderr)
+				failed = True
+			else:
+				if not quiet: print(f"{outfile}", file=stderr)
+	if profiles:
+		import timing
+		print(timing.report(profiles), file=stderr)
+		for file_profile in sorted(profiles, key=lambda p: -p.total)[:profile_dump]:
+			if file_profile.stats is not None and file_profile.outfile is not None:
+				path = file_profile.outfile.with_name(file_profile.outfile.name + ".prof")
+				file_profile.dump_stats(path)
+				print(f"wrote {path}", file=stderr)
+
 	if failed and os.name == "nt":
 		os.system("pause")
 	return 0 if not failed else 2
 
-def process_file(make_output: T.Callable[[Path, str], Path], insns: InsnTable | None, file: Path) -> Path:
+def init_worker(encoding: str) -> None:
+	settings.ENCODING = encoding
+
+def output_beside(path: Path, suffix: str) -> Path:
+	return path.with_suffix(suffix)
+
+def output_file(output: Path, path: Path, suffix: str) -> Path:
+	return output
+
+def output_dir(output: Path, path: Path, suffix: str) -> Path:
+	return output / path.with_suffix(suffix).name
+
+Stage: T.TypeAlias = T.Callable[[str], T.ContextManager[None]]
+
+def no_stage(name: str) -> T.ContextManager[None]:
+	return contextlib.nullcontext()
+
+def process_file(make_output: T.Callable[[Path, str], Path], insns: InsnTable | None, file: Path, executor: Executor | None = None, cache: Cache | None = None, parser: str = "lark", stage: Stage = no_stage) -> Path:
+	outfile = make_output(*output_name(file))
+	if cache is None:
+		convert_file(insns, file, outfile, executor, parser, stage)
+		return outfile
+
+	with stage("cache"):
+		insns_id = repr(sorted(insns.items())) if insns is not None else ""
+		key = cache.key(file.read_bytes(), outfile.suffix, insns_id, settings.ENCODING)
+		hit = cache.fetch(key, outfile)
+	if not hit:
+		convert_file(insns, file, outfile, executor, parser, stage)
+		with stage("cache"):
+			cache.store(key, outfile)
+	return outfile
+
+def profile_file(cprofile: bool, make_output: T.Callable[[Path, str], Path], insns: InsnTable | None, file: Path, executor: Executor | None = None, cache: Cache | None = None, parser: str = "lark") -> tuple[Path, FileProfile]:
+	from timing import FileProfile
+	profile = FileProfile(file)
+	with profile.run(cprofile):
+		profile.outfile = process_file(make_output, insns, file, executor, cache, parser, profile.stage)
+	return profile.outfile, profile
+
+class RoundtripError(Exception): pass
+
+def verify_file(insns: InsnTable | None, file: Path) -> str:
+	if file.suffix != ".bin":
+		return "skipped, only .bin files can be verified"
+	import parse_bin, print_bin
+	data = file.read_bytes()
+	scp = parse_bin.parse_ys7_scp(data, insns)
+	# Decode the expressions too, so that they aren't just copied through
+	for _, code in scp.functions:
+		parse_bin.decode_exprs(code)
+	outdata = print_bin.write_ys7_scp(scp, insns)
+	if outdata == data:
+		return f"ok, {len(scp.functions)} functions"
+
+	_, _, _, functbl = parse_bin.parse_functbl(memoryview(data), insns)
+	_, _, _, outfunctbl = parse_bin.parse_functbl(memoryview(outdata), insns)
+	errors = []
+	for (name, start, end), (_, outstart, outend) in zip(functbl, outfunctbl):
+		if data[start:end] != outdata[outstart:outend]:
+			errors.append(describe_diff(name, data[start:end], outdata[outstart:outend]))
+	if not errors:
+		errors.append(describe_diff("header", data, outdata))
+	more = f"\n... and {len(errors) - 3} more functions" if len(errors) > 3 else ""
+	raise RoundtripError(f"{len(errors)} of {len(scp.functions)} functions differ\n" + "\n".join(errors[:3]) + more)
+
+def describe_diff(name: str, a: bytes, b: bytes) -> str:
+	import read
+	pos = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+	start = max(pos - pos % 16 - 16, 0)
+	return (
+		f"{name}: differs at 0x{pos:X} ({len(a)} bytes, recompiled to {len(b)})\n"
+		f"original at 0x{start:X}:\n{read.dump(a[start:start+64], 16)}"
+		f"recompiled at 0x{start:X}:\n{read.dump(b[start:start+64], 16)}"
+	)
+
+def output_name(file: Path) -> tuple[Path, str]:
 	if file.suffix == ".bin":
-		data = file.read_bytes()
-		scp = parse_bin.parse_ys7_scp(data, insns)
-		src = print_text.print_ys7_scp(scp)
-		outfile = make_output(file, ".7l")
-		outfile.write_bytes(src.encode("utf8"))
+		return file, ".7l"
 	elif file.suffix == ".7l":
-		src = file.read_bytes().decode("utf8")
-		scp = parse_text.parse_ys7_scp(src)
-		outdata = print_bin.write_ys7_scp(scp, insns)
-		outfile = make_output(file, ".bin")
-		outfile.write_bytes(outdata)
+		return file, ".bin"
 	elif file.suffix == ".scp":
-		try:
-			lines = file.read_bytes().decode("utf8").split('\0')
-			match lines.pop():
-				case "\t": pass
-				case "\t\r\n": lines.extend(["", ""])
-				case _: raise Exception
-			assert not len(lines) % 2
-		except Exception:
-			raise Exception("invalid .scp file — is it a script source?")
-		outfile = make_output(file, ".csv")
-		with outfile.open("w", encoding="utf8", newline="") as f:
+		return file, ".csv"
+	elif file.suffix == ".csv":
+		return file, ".scp"
+	elif file.suffix == ".dbin":
+		return file, ".dbin.json"
+	elif file.name.endswith(".dbin.json"):
+		return file.with_suffix(""), ".dbin"
+	else:
+		raise Exception(f"not sure how to handle")
+
+def convert_file(insns: InsnTable | None, file: Path, outfile: Path, executor: Executor | None = None, parser: str = "lark", stage: Stage = no_stage) -> None:
+	if file.suffix == ".bin":
+		import parse_bin, print_text
+		with stage("read"):
+			data = file.read_bytes()
+		with stage("parse_bin"):
+			scp = parse_bin.parse_ys7_scp(data, insns, executor)
+			for _, code in scp.functions:
+				parse_bin.decode_exprs(code)
+		# The text is streamed to the file, so this includes encoding and writing it.
+		# It goes to a temporary file first, so that a failure doesn't leave a
+		# truncated .7l in place of an existing one.
+		with stage("print_text"):
+			tmp = outfile.with_name(f"{outfile.name}.{os.getpid()}.tmp")
+			try:
+				with tmp.open("w", encoding="utf8", newline="") as f:
+					print_text.write_ys7_scp(scp, f)
+				os.replace(tmp, outfile)
+			except BaseException:
+				tmp.unlink(missing_ok=True)
+				raise
+	elif file.suffix == ".7l":
+		import print_bin
+		with stage("read"):
+			data = file.read_bytes()
+		with stage("decode"):
+			src = data.decode("utf8")
+		with stage("parse_text"):
+			if parser == "rd":
+				import parse_text_rd
+				scp = parse_text_rd.parse_ys7_scp(src)
+			else:
+				import parse_text
+				scp = parse_text.parse_ys7_scp(src)
+		with stage("print_bin"):
+			outdata = print_bin.write_ys7_scp(scp, insns, executor)
+		with stage("write"):
+			outfile.write_bytes(outdata)
+	elif file.suffix == ".scp":
+		import csv
+		with stage("read"):
+			data = file.read_bytes()
+		with stage("parse"):
+			try:
+				lines = data.decode("utf8").split('\0')
+				match lines.pop():
+					case "\t": pass
+					case "\t\r\n": lines.extend(["", ""])
+					case _: raise Exception
+				assert not len(lines) % 2
+			except Exception:
+				raise Exception("invalid .scp file — is it a script source?")
+		with stage("write"), outfile.open("w", encoding="utf8", newline="") as f:
 			csv.writer(f).writerows(zip(lines[0::2], lines[1::2]))
 	elif file.suffix == ".csv":
+		import csv
 		strings = []
-		with file.open(encoding="utf8") as f:
+		with stage("read"), file.open(encoding="utf8") as f:
 			for row in csv.reader(f):
 				assert len(row) == 2, f"invalid row {row}"
 				strings.extend(row)
@@ -89,21 +264,30 @@ def process_file(make_output: T.Callable[[Path, str], Path], insns: InsnTable |
 			strings[-2:] = ["\t\r\n"]
 		else:
 			strings.append("\t")
-		outfile = make_output(file, ".scp")
-		outfile.write_bytes("\0".join(strings).encode("utf8"))
+		with stage("encode"):
+			outdata = "\0".join(strings).encode("utf8")
+		with stage("write"):
+			outfile.write_bytes(outdata)
 	elif file.suffix == ".dbin":
-		data = file.read_bytes()
-		outdata = dbin.parse_dbin(data)
-		outfile = make_output(file, ".dbin.json")
-		outfile.write_bytes(outdata.encode("utf8"))
+		import dbin
+		with stage("read"):
+			data = file.read_bytes()
+		with stage("parse_dbin"):
+			text = dbin.parse_dbin(data)
+		with stage("encode"):
+			outdata = text.encode("utf8")
+		with stage("write"):
+			outfile.write_bytes(outdata)
 	elif file.name.endswith(".dbin.json"):
-		data = file.read_bytes().decode("utf8")
-		outdata = dbin.parse_json(data)
-		outfile = make_output(file.with_suffix(""), ".dbin")
-		outfile.write_bytes(outdata)
+		import dbin
+		with stage("read"):
+			text = file.read_bytes().decode("utf8")
+		with stage("parse_json"):
+			outdata = dbin.parse_json(text)
+		with stage("write"):
+			outfile.write_bytes(outdata)
 	else:
 		raise Exception(f"not sure how to handle")
-	return outfile
 
 if __name__ == "__main__":
 	exit(__main__(**argp.parse_args().__dict__))
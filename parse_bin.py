@@ -1,16 +1,81 @@
 from __future__ import annotations
 import read
 import typing as T
+import dataclasses as dc
+import functools
+import itertools
 import settings
 
-from common import insn_tables, InsnTable, Insn, Expr, Binop, Unop, Call, Index, AExpr, Ys7Scp
+from common import insn_tables, InsnTable, Insn, Arg, Expr, Binop, Unop, Call, Index, AExpr, Ys7Scp
 
-def parse_ys7_scp(data: bytes, insns: InsnTable | None = None) -> Ys7Scp:
+if T.TYPE_CHECKING:
+	from concurrent.futures import Executor
+	from store import InsnStore, StringPool
+
+@dc.dataclass(repr=False, eq=False)
+class LazyFunction:
+	data: memoryview
+	start: int
+	length: int
+	insns: InsnTable
+	version: int
+
+	def __repr__(self) -> str:
+		return f"{type(self).__name__}(0x{self.start:X}, {self.length})"
+
+	@functools.cached_property
+	def code(self) -> list[Insn]:
+		return parse_func(self.data[self.start:self.start+self.length], self.insns, self.version)
+
+	@property
+	def decoded(self) -> bool:
+		return "code" in self.__dict__
+
+@dc.dataclass
+class LazyYs7Scp:
+	version: int
+	hash: bytes # length 8
+	functions: dict[str, LazyFunction]
+
+	def load(self) -> Ys7Scp:
+		return Ys7Scp(self.version, self.hash, [(name, func.code) for name, func in self.functions.items()])
+
+def parse_ys7_scp(data: bytes, insns: InsnTable | None = None, executor: Executor | None = None) -> Ys7Scp:
+	data = memoryview(data)
+	version, hash, insns, functbl = parse_functbl(data, insns)
+	names = [name for name, _, _ in functbl]
+	if executor is None:
+		codes = [parse_func(data[start:end], insns, version) for _, start, end in functbl]
+	else:
+		chunks = [bytes(data[start:end]) for _, start, end in functbl]
+		codes = executor.map(parse_func, chunks, itertools.repeat(insns), itertools.repeat(version), chunksize=16)
+	return Ys7Scp(version, hash, list(zip(names, codes)))
+
+def parse_ys7_scp_lazy(data: bytes, insns: InsnTable | None = None) -> LazyYs7Scp:
+	data = memoryview(data)
+	version, hash, insns, functbl = parse_functbl(data, insns)
+	functions = {}
+	for name, start, end in functbl:
+		if name in functions:
+			raise ValueError(f"duplicate function {name}")
+		functions[name] = LazyFunction(data, start, end - start, insns, version)
+	return LazyYs7Scp(version, hash, functions)
+
+def parse_ys7_scp_store(data: bytes, insns: InsnTable | None = None, pool: StringPool | None = None) -> InsnStore:
+	from store import InsnStore, StringPool
+	data = memoryview(data)
+	version, hash, insns, functbl = parse_functbl(data, insns)
+	out = InsnStore(version, hash, pool if pool is not None else StringPool())
+	for name, start, end in functbl:
+		out.add_function(name, parse_func(data[start:end], insns, version))
+	return out
+
+def parse_functbl(data: memoryview, insns: InsnTable | None) -> tuple[int, bytes, InsnTable, list[tuple[str, int, int]]]:
 	f = read.Reader(data)
 	f.check(b"YS7_SCP")
 	f.check_u32(0)
 	version = f.u8()
-	hash = f[8]
+	hash = bytes(f[8])
 	nfuncs = f.u32()
 
 	if insns is None:
@@ -18,21 +83,20 @@ def parse_ys7_scp(data: bytes, insns: InsnTable | None = None) -> Ys7Scp:
 
 	functbl = []
 	for _ in range(nfuncs):
-		name = f[32].rstrip(b"\0").decode(settings.ENCODING)
-		length = f.u32()
-		start = f.u32()
+		name, length, start = f.unpack("32sII")
+		name = name.rstrip(b"\0").decode(settings.ENCODING)
 		functbl.append((name, start, length))
 
 	ends = [start for _, start, _ in functbl[1:]] + [len(data)]
-	functions = []
+	out = []
 	for (name, start, length), end in zip(functbl, ends):
 		if start+length != end:
 			print(f"{name}: incorrect length {length}, should be {end - start}")
-		functions.append((name, parse_func(data[start:end], insns, version)))
+		out.append((name, start, end))
 
-	return Ys7Scp(version, hash, functions)
+	return version, hash, insns, out
 
-def parse_func(data: bytes, insns: InsnTable, version: int) -> list[Insn]:
+def parse_func(data: bytes | memoryview, insns: InsnTable, version: int) -> list[Insn]:
 	f = read.Reader(data)
 	code = parse_block(f, len(data), insns)
 	assert not f.remaining
@@ -93,34 +157,38 @@ def parse_insn(f: read.Reader, insns: InsnTable) -> Insn:
 	name = insns.get(op, f"op_{op:04X}")
 	args = []
 	while f.remaining:
-		match f.u16():
-			case 0x82DD:
-				args.append(f.i32())
-			case 0x82DE:
-				args.append(f.f32())
-			case 0x82DF:
-				args.append(f[f.u32()].decode(settings.ENCODING))
-			case 0x82E0:
-				args.append(AExpr(parse_expr(f.sub(f.u32()))))
-			case 0x2020:
-				nlines, nbytes = f.u32(), f.u32()
-				starts = [f.u32() for _ in range(nlines)]
-				text = f[nbytes]
-				val = []
-				for a, b in zip(starts, starts[1:] + [nbytes]):
-					s = text[a:b].decode(settings.ENCODING)
-					assert s.endswith("\x01")
-					val.append(s[:-1])
-				args.append(val)
-
-			case op:
-				f.pos -= 2
-				break
+		parse = arg_parsers.get(f.u16())
+		if parse is None:
+			f.pos -= 2
+			break
+		args.append(parse(f))
 
-	insn = Insn(name, args)
-	insn.startpos = startpos
-	insn.pos = f.pos
-	return insn
+	return Insn(name, args, startpos=startpos, pos=f.pos)
+
+def parse_str_arg(f: read.Reader) -> str:
+	return str(f[f.u32()], settings.ENCODING)
+
+def parse_expr_arg(f: read.Reader) -> AExpr:
+	return AExpr.from_bytes(bytes(f[f.u32()]))
+
+def parse_lines_arg(f: read.Reader) -> list[str]:
+	nlines, nbytes = f.unpack("II")
+	starts = memoryview(f[4*nlines]).cast("I").tolist()
+	text = f[nbytes]
+	val = []
+	for a, b in zip(starts, starts[1:] + [nbytes]):
+		s = str(text[a:b], settings.ENCODING)
+		assert s.endswith("\x01")
+		val.append(s[:-1])
+	return val
+
+arg_parsers: dict[int, T.Callable[[read.Reader], Arg]] = {
+	0x82DD: read.Reader.i32,
+	0x82DE: read.Reader.f32,
+	0x82DF: parse_str_arg,
+	0x82E0: parse_expr_arg,
+	0x2020: parse_lines_arg,
+}
 
 def parse_ys9_switch(f: read.Reader, insns: InsnTable, stmt: Insn) -> Insn:
 	stmt.name = "switch"
@@ -224,40 +292,48 @@ expr = {
 	0x48: ('index', "GOTITEMWORK"),
 }
 
+# Each handler reads its operands and pushes the result onto the stack
+ExprHandler: T.TypeAlias = T.Callable[[read.Reader, list[Expr]], None]
+
+def pop_expr(ops: list[Expr]) -> Expr:
+	return ops.pop() if ops else Call("expr_missing", [])
+
+def expr_handler(opcode: int, desc: T.Any) -> ExprHandler:
+	match desc:
+		case "int":
+			def h(f, ops): ops.append(f.i32())
+		case "float":
+			def h(f, ops): ops.append(f.f32())
+		case "chr":
+			def h(f, ops): ops.append(str(f[f.u32()], settings.ENCODING))
+		case "unop", op:
+			def h(f, ops): ops.append(Unop(op, pop_expr(ops)))
+		case "binop", op:
+			def h(f, ops):
+				b = pop_expr(ops)
+				ops.append(Binop(pop_expr(ops), op, b))
+		case "index", name:
+			def h(f, ops): ops.append(Index(name, pop_expr(ops)))
+		case "func", name, n:
+			def h(f, ops): ops.append(Call(name, [pop_expr(ops) for _ in range(n)][::-1]))
+		case desc:
+			def h(f, ops): raise ValueError(hex(opcode), desc)
+	return h
+
+expr_end = next(k for k, v in expr.items() if v == "break")
+expr_handlers: dict[int, ExprHandler] = { k: expr_handler(k, v) for k, v in expr.items() if k != expr_end }
+
 def parse_expr(f: read.Reader) -> Expr:
-	ops = []
-	def pop() -> Expr:
-		return ops.pop() if ops else Call("expr_missing", [])
-	while True:
-		opcode = f.u16()
-		match expr.get(opcode):
-			case "break":
-				break
-			case "int":
-				ops.append(f.i32())
-			case "float":
-				ops.append(f.f32())
-			case "chr":
-				ops.append(f[f.u32()].decode(settings.ENCODING))
-			case "unop", op:
-				a = pop()
-				ops.append(Unop(op, a))
-			case "binop", op:
-				b = pop()
-				a = pop()
-				ops.append(Binop(a, op, b))
-			case "index", name:
-				a = pop()
-				ops.append(Index(name, a))
-			case "func", name, n:
-				args = [pop() for _ in range(n)][::-1]
-				ops.append(Call(name, args))
-			case desc:
-				raise ValueError(hex(opcode), desc)
+	ops: list[Expr] = []
+	while (opcode := f.u16()) != expr_end:
+		handler = expr_handlers.get(opcode)
+		if handler is None:
+			raise ValueError(hex(opcode), None)
+		handler(f, ops)
 	assert not f.remaining
 	while len(ops) > 1:
 		return Call("expr_missing", ops)
-	return pop()
+	return pop_expr(ops)
 
 def fix_break(code: list[Insn], end: int):
 	for i in code:
@@ -294,3 +370,13 @@ def strip_tail(code: list[Insn], tail: str | None):
 	for insn in code:
 		if insn.body is not None:
 			strip_tail(insn.body, tails.get(insn.name))
+
+def decode_exprs(code: list[Insn]):
+	# Expressions are decoded lazily; this forces them, so that a malformed one
+	# fails here rather than wherever it's first looked at
+	for insn in code:
+		for arg in insn.args:
+			if isinstance(arg, AExpr):
+				arg.expr
+		if insn.body is not None:
+			decode_exprs(insn.body)
@@ -5,14 +5,10 @@ from common import Insn, Binop, Unop, Call, Index, AExpr, Ys7Scp
 
 try:
 	from lark import Lark, Transformer, v_args
-	parser = Lark((Path(__file__).parent / "grammar.g").read_text(), parser="lalr")
+	standalone = False
 except ImportError:
 	from grammar import Lark_StandAlone, Transformer, v_args
-	# Generate with
-	#   python -m lark.tools.standalone --maybe_placeholders grammar.g -o grammar.py
-	# Unfortunately PYTHONHASHSEED doesn't work
-	parser = Lark_StandAlone()
-	assert parser.options.maybe_placeholders, "grammar not compliled correctly"
+	standalone = True
 
 @v_args(inline=True)
 class Parser(Transformer):
@@ -47,5 +43,15 @@ class Parser(Transformer):
 			return super().__default__(name, tokens, meta)
 		raise AttributeError(name, tokens)
 
+# The transformer is applied during LALR reductions, so no parse tree is built
+if not standalone:
+	parser = Lark((Path(__file__).parent / "grammar.g").read_text(), parser="lalr", transformer=Parser())
+else:
+	# Generate with
+	#   python -m lark.tools.standalone --maybe_placeholders grammar.g -o grammar.py
+	# Unfortunately PYTHONHASHSEED doesn't work
+	parser = Lark_StandAlone(transformer=Parser())
+	assert parser.options.maybe_placeholders, "grammar not compliled correctly"
+
 def parse_ys7_scp(src: str) -> Ys7Scp:
-	return Parser().transform(parser.parse(src))
+	return parser.parse(src)
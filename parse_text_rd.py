@@ -0,0 +1,203 @@
+from __future__ import annotations
+import typing as T
+import re
+
+from common import Insn, Expr, Arg, Binop, Unop, Call, Index, AExpr, Ys7Scp
+
+__all__ = ["parse_ys7_scp"]
+
+# A hand-written equivalent of the grammar in grammar.g, building the AST
+# directly instead of going through a parse tree.
+
+token = re.compile(r"""
+	(?P<ws>(?:[ \t\r\n]|//.*)+)
+	| (?P<str>"(?:[^"]|"")*")
+	| (?P<number>\d+(?:\.\d+)?)
+	| (?P<word>(?!\d)\w+)
+	| (?P<op>\|\|?|&&?|[!=]=|[<>]=?|[-+*/%.!])
+	| (?P<punct>[(){}\[\],])
+""", re.VERBOSE)
+
+binops = [
+	{"expr_missing_op"},
+	{"|", "||"},
+	{"&", "&&"},
+	{"==", "!=", "<", ">", "<=", ">="},
+	{"+", "-"},
+	{"*", "/", "%"},
+]
+
+Token: T.TypeAlias = tuple[str, str, int, int] # kind, text, start, end
+
+def tokenize(src: str) -> list[Token]:
+	out = []
+	pos = 0
+	for m in token.finditer(src):
+		if m.start() != pos:
+			break
+		pos = m.end()
+		match m.lastgroup:
+			case "ws": pass
+			case "op" | "punct": out.append((m.group(), m.group(), m.start(), pos))
+			case kind: out.append((kind, m.group(), m.start(), pos))
+	if pos != len(src):
+		raise ValueError(f"{location(src, pos)}: unexpected character {src[pos]!r}")
+	out.append(("eof", "", pos, pos))
+	return out
+
+def location(src: str, pos: int) -> str:
+	line = src.count("\n", 0, pos) + 1
+	col = pos - src.rfind("\n", 0, pos)
+	return f"line {line}, column {col}"
+
+class Parser:
+	def __init__(self, src: str):
+		self.src = src
+		self.tokens = tokenize(src)
+		self.i = 0
+
+	@property
+	def kind(self) -> str:
+		return self.tokens[self.i][0]
+
+	def next(self) -> str:
+		tok = self.tokens[self.i]
+		self.i += 1
+		return tok[1]
+
+	def expect(self, kind: str, text: str | None = None) -> str:
+		tok = self.tokens[self.i]
+		if tok[0] != kind or text is not None and tok[1] != text:
+			self.error()
+		self.i += 1
+		return tok[1]
+
+	def error(self) -> T.NoReturn:
+		kind, text, start, _ = self.tokens[self.i]
+		raise ValueError(f"{location(self.src, start)}: " + (f"unexpected {text!r}" if kind != "eof" else "unexpected end of input"))
+
+	def start(self) -> Ys7Scp:
+		self.expect("word", "version")
+		if not self.tokens[self.i][1].isdigit():
+			self.error()
+		version = int(self.next())
+		self.expect("word", "hash")
+		hash = bytes.fromhex(self.string())
+
+		functions = []
+		while self.kind != "eof":
+			self.expect("word", "function")
+			name = self.string()
+			functions.append((name, self.block()))
+		return Ys7Scp(version, hash, functions)
+
+	def string(self) -> str:
+		return self.expect("str")[1:-1].replace('""', '"')
+
+	# The number terminal includes an optional minus sign, so a minus
+	# directly followed by digits is a negative literal rather than a unop.
+	def is_number(self) -> bool:
+		kind, _, start, _ = self.tokens[self.i]
+		if kind == "number":
+			return True
+		if kind == "eof":
+			return False
+		next_kind, _, next_start, _ = self.tokens[self.i+1]
+		return kind == "-" and next_kind == "number" and next_start == start + 1
+
+	def number(self) -> int | float:
+		text = self.next()
+		if text == "-":
+			text += self.next()
+		return float(text) if "." in text else int(text)
+
+	def block(self) -> list[Insn]:
+		self.expect("{")
+		out = []
+		while self.kind != "}":
+			out.append(self.stmt())
+		self.next()
+		return out
+
+	def stmt(self) -> Insn:
+		name = self.expect("word")
+		self.expect("(")
+		args = []
+		while self.kind != ")":
+			args.append(self.term())
+			if self.kind != ")":
+				self.expect(",")
+		self.next()
+		body = self.block() if self.kind == "{" else None
+		return Insn(name, args, body)
+
+	def term(self) -> Arg:
+		if self.is_number():
+			return self.number()
+		match self.kind:
+			case "str":
+				return self.string()
+			case "(":
+				self.next()
+				e = self.expr()
+				self.expect(")")
+				return AExpr(e)
+			case "{":
+				self.next()
+				lines = []
+				while self.kind != "}":
+					lines.append(self.string())
+				self.next()
+				return lines
+			case _:
+				self.error()
+
+	def expr(self, level: int = 0) -> Expr:
+		if level == len(binops):
+			return self.unary()
+		ops = binops[level]
+		a = self.expr(level + 1)
+		while self.tokens[self.i][1] in ops:
+			op = self.next()
+			b = self.expr(level + 1)
+			a = Binop(a, op, b)
+		return a
+
+	def unary(self) -> Expr:
+		if self.is_number():
+			return self.number()
+		match self.kind:
+			case "!" | "-":
+				op = self.next()
+				return Unop(op, self.unary())
+			case "str":
+				s = self.string()
+				if self.kind == ".":
+					self.next()
+					return Binop(s, ".", self.unary())
+				return s
+			case "(":
+				self.next()
+				e = self.expr()
+				self.expect(")")
+				return e
+			case "word":
+				name = self.next()
+				if self.kind == "[":
+					self.next()
+					e = self.expr()
+					self.expect("]")
+					return Index(name, e)
+				self.expect("(")
+				args = []
+				while self.kind != ")":
+					args.append(self.expr())
+					if self.kind != ")":
+						self.expect(",")
+				self.next()
+				return Call(name, args)
+			case _:
+				self.error()
+
+def parse_ys7_scp(src: str) -> Ys7Scp:
+	return Parser(src).start()
@@ -1,18 +1,27 @@
 from __future__ import annotations
-from copy import deepcopy
 import typing as T
+import itertools
 import settings
 
-from common import insn_tables, InsnTable, Insn, Expr, Binop, Unop, Call, Index, AExpr, Ys7Scp, Arg
+from common import insn_tables, compile_table, InsnTable, Insn, Expr, Binop, Unop, Call, Index, AExpr, Ys7Scp, Arg
 from read import Writer, Label
 import parse_bin
 
+if T.TYPE_CHECKING:
+	from concurrent.futures import Executor
+
 RevInsnTable: T.TypeAlias = dict[str, int]
 
-def write_ys7_scp(scp: Ys7Scp, insns: InsnTable | None = None) -> bytes:
+def write_ys7_scp(scp: Ys7Scp, insns: InsnTable | None = None, executor: Executor | None = None) -> bytes:
 	if insns is None:
 		insns = insn_tables.get(scp.version, {})
-	_insns = { v: k for k, v in insns.items() }
+	_insns = compile_table(insns).opcodes
+
+	codes = [code for _, code in scp.functions]
+	if executor is None:
+		funcdatas = [write_func(code, _insns, scp.version) for code in codes]
+	else:
+		funcdatas = executor.map(write_func, codes, itertools.repeat(_insns), itertools.repeat(scp.version), chunksize=16)
 
 	f = Writer()
 	start = f.place(Label())
@@ -24,10 +33,9 @@ def write_ys7_scp(scp: Ys7Scp, insns: InsnTable | None = None) -> bytes:
 	f.u32(len(scp.functions))
 
 	data = Writer()
-	for name, code in scp.functions:
+	for (name, _), funcdata in zip(scp.functions, funcdatas):
 		name = name.encode(settings.ENCODING).ljust(32, b"\0")
 		assert len(name) == 32
-		funcdata = write_func(code, _insns, scp.version)
 		f.write(name)
 		f.u32(len(funcdata))
 		f.diff(4, start, data.place(Label()))
@@ -36,80 +44,81 @@ def write_ys7_scp(scp: Ys7Scp, insns: InsnTable | None = None) -> bytes:
 	return bytes(f + data)
 
 def write_func(code: list[Insn], insns: RevInsnTable, version: int) -> bytes:
-	code = deepcopy(code)
-	insert_tail(code, "return")
-	if version >= 6:
-		mangle_return(code)
-	return bytes(write_block(code, insns, None))
+	if version >= 6 and code and (lowered := mangle_return(code[-1])):
+		f = write_block(code[:-1], insns, None, None)
+		f += write_stmt(code[-1], insns, None, *lowered)
+		return bytes(f)
+	return bytes(write_block(code, insns, None, "return"))
 
-def write_block(code: list[Insn], insns: RevInsnTable, brk: Label | None) -> Writer:
+def write_block(code: list[Insn], insns: RevInsnTable, brk: Label | None, tail: str | None) -> Writer:
 	out = Writer()
 	for stmt in code:
-		out += write_stmt(stmt, insns, brk)
+		out += write_stmt(stmt, insns, brk, *lower_body(stmt))
+	if tail is not None:
+		out += write_insn(tail, [], insns)
 	return out
 
-def write_stmt(stmt: Insn, insns: RevInsnTable, brk: Label | None) -> Writer:
+def write_stmt(stmt: Insn, insns: RevInsnTable, brk: Label | None, body: list[Insn] | None, tail: str | None) -> Writer:
+	args = stmt.args
 	match stmt.name:
-		case "Message": stmt.args[-1] = "\\n".join(stmt.args[-1])
-		case "OpenMessage": stmt.args[-1] = "\\n".join(stmt.args[-1])
-		case "Message2": stmt.args[3:] = stmt.args[3]
-		case "YesNoMenu": stmt.args[1] = "\\n".join(stmt.args[1])
-		case "GetItemMessageExPlus": stmt.args[3] = "\\n".join(stmt.args[3])
-		case "NoiSystemMessage": stmt.args[-1] = "\r\n".join(stmt.args[-1])
+		case "Message": args = [*args[:-1], "\\n".join(args[-1])]
+		case "OpenMessage": args = [*args[:-1], "\\n".join(args[-1])]
+		case "Message2": args = [*args[:3], *args[3]]
+		case "YesNoMenu": args = [args[0], "\\n".join(args[1]), *args[2:]]
+		case "GetItemMessageExPlus": args = [*args[:3], "\\n".join(args[3]), *args[4:]]
+		case "NoiSystemMessage": args = [*args[:-1], "\r\n".join(args[-1])]
 
 	f = Writer()
 	end = Label()
 
 	if stmt.name == "break":
-		assert not stmt.args
+		assert not args
 		assert brk is not None
-		f += write_insn(stmt, insns)
+		f += write_insn(stmt.name, args, insns)
 		f += write_label(brk)
 
-	elif not stmt.body:
-		f += write_insn(stmt, insns)
+	elif not body and tail is None:
+		f += write_insn(stmt.name, args, insns)
 
 	elif stmt.name in { "if", "elif", "else", "case", "default", "ExecuteCmd" }:
-		f += write_insn(stmt, insns)
+		f += write_insn(stmt.name, args, insns)
 		f += write_label(end)
-		f += write_block(stmt.body, insns, brk)
+		f += write_block(body, insns, brk, tail)
 
 	elif stmt.name == "while":
-		stmt.name = "if"
 		start = f.place(Label())
-		f += write_insn(stmt, insns)
+		f += write_insn("if", args, insns)
 		f += write_label(end)
-		f += write_block(stmt.body, insns, end)
-		f += write_insn(Insn("goto", []), insns)
+		f += write_block(body, insns, end, tail)
+		f += write_insn("goto", [], insns)
 		f += write_label(start)
 
 	elif stmt.name == "switch":
 		if "switch9" in insns:
-			stmt.name = "switch9"
-			has_default = any(case.name == "default" for case in stmt.body)
-			if not has_default:
-				stmt.body.insert(-1, Insn("default", [], [Insn("break", [])]))
-			stmt.args.append(len(stmt.body) - 1)
+			cases = body
+			if not any(case.name == "default" for case in cases):
+				cases = [*cases, Insn("default", [], [Insn("break", [])])]
 			g = Writer()
 			labels = []
-			for case in stmt.body:
+			for case in cases:
 				if case.name in { "case", "default" }:
-					case.name += "9"
 					labels.append(g.place(Label()))
-					g += write_insn(case, insns)
-					g += write_block(case.body, insns, end)
+					g += write_insn(case.name + "9", case.args, insns)
+					g += write_block(case.body, insns, end, None)
 				else:
-					g += write_insn(case, insns)
+					g += write_insn(case.name, case.args, insns)
+			if tail is not None:
+				g += write_insn(tail, [], insns)
 
-			f += write_insn(stmt, insns)
+			f += write_insn("switch9", [*args, len(cases)], insns)
 			f.u16(0)
 			f += write_label(labels[-1], 6)
 			for l in labels[:-1]:
 				f += write_label(l, 6)
 			f += g
 		else:
-			f += write_insn(stmt, insns)
-			f += write_block(stmt.body, insns, end)
+			f += write_insn(stmt.name, args, insns)
+			f += write_block(body, insns, end, tail)
 
 	else:
 		raise ValueError(stmt)
@@ -117,11 +126,27 @@ def write_stmt(stmt: Insn, insns: RevInsnTable, brk: Label | None) -> Writer:
 	f.place(end)
 	return f
 
-def write_insn(insn: Insn, insns: RevInsnTable) -> Writer:
-	op = int(insn.name[3:], 16) if insn.name.startswith("op_") else insns[insn.name]
+def lower_body(insn: Insn) -> tuple[list[Insn] | None, str | None]:
+	# The body, and the instruction the encoded block ends with
+	if insn.body is None:
+		return None, None
+	return insn.body, parse_bin.tails.get(insn.name)
+
+def mangle_return(insn: Insn) -> tuple[list[Insn], str | None] | None:
+	# From Ys VIII, a function ending in a block returns at the end of the block
+	# rather than after it
+	body, tail = lower_body(insn)
+	if tail is None and body and body[-1] == Insn("endif"):
+		body, tail = body[:-1], "endif"
+	if body is None or tail != "endif":
+		return None
+	return body, None if insn.name == "while" else "return"
+
+def write_insn(name: str, args: list[Arg], insns: RevInsnTable) -> Writer:
+	op = insns[name]
 	f = Writer()
 	f.u16(op)
-	for arg in insn.args:
+	for arg in args:
 		match arg:
 			case int(v):
 				f.u16(0x82DD)
@@ -137,8 +162,8 @@ def write_insn(insn: Insn, insns: RevInsnTable) -> Writer:
 				f.u32(len(v))
 				f.write(v)
 
-			case AExpr(v):
-				bs = write_expr(v)
+			case AExpr():
+				bs = arg.raw if arg.raw is not None else write_expr(arg.expr)
 				f.u16(0x82E0)
 				f.u32(len(bs))
 				f.write(bs)
@@ -213,18 +238,4 @@ def write_expr(e: Expr) -> bytes:
 				raise ValueError(e)
 	w(e)
 	f.u16(0x1D)
-	return f.data
-
-def mangle_return(code: list[Insn]):
-	if len(code) >= 2 and code[-2].body is not None and code[-2].body[-1] == Insn("endif"):
-		code[-2].body.pop()
-		if code[-2].name != "while":
-			code[-2].body.append(Insn("return"))
-		code.pop()
-
-def insert_tail(code: list[Insn], tail: str | None):
-	if tail is not None:
-		code.append(Insn(tail))
-	for insn in code:
-		if insn.body is not None:
-			insert_tail(insn.body, parse_bin.tails.get(insn.name))
+	return bytes(f)
@@ -1,9 +1,14 @@
 from __future__ import annotations
-from textwrap import indent
+import typing as T
 import struct
+import functools
+import math
+import io
 
 from common import Insn, Expr, Binop, Unop, Call, Index, AExpr, Ys7Scp
 
+_F32 = struct.Struct("f")
+
 binops = {
 	"|": 1,
 	"||": 1,
@@ -36,9 +41,23 @@ def print_str(s: str) -> str:
 	return '"' + s.replace('"', '""') + '"'
 
 def print_float(f: float) -> str:
-	for i in range(50):
+	if f and math.isfinite(f):
+		return _print_float(f)
+	return _search_float(f, _F32.pack(f), 0)
+
+@functools.lru_cache(maxsize=1 << 16)
+def _print_float(f: float) -> str:
+	target = _F32.pack(f)
+	start = 0
+	# With fewer decimals than this, f prints as ±0, which can't match unless f rounds to zero
+	if abs(f) < 1e-3 and _F32.unpack(target)[0]:
+		start = -math.floor(math.log10(abs(f))) - 3
+	return _search_float(f, target, start)
+
+def _search_float(f: float, target: bytes, start: int) -> str:
+	for i in range(start, 50):
 		s = f"{f:.{i}f}"
-		if struct.pack("f", f) == struct.pack("f", float(s)):
+		if _F32.pack(float(s)) == target:
 			return s
 	raise ValueError(f"no repr for {f}")
 
@@ -58,8 +77,15 @@ def print_expr(e: Expr, prio: int = 1000) -> str:
 		case _: raise ValueError(e)
 	return f"({r})" if prio2 < prio else r
 
-def print_code(code: list[Insn]) -> str:
-	s = ""
+def print_code(code: list[Insn], depth: int = 0) -> str:
+	out: list[str] = []
+	write_code(code, out.append, depth)
+	return "".join(out)
+
+def write_code(code: list[Insn], write: T.Callable[[str], T.Any], depth: int = 0) -> None:
+	ind = "\t" * (depth + 1)
+	write("{\n")
+	newline = True
 	for i, insn in enumerate(code):
 		args = []
 		for a in insn.args:
@@ -68,24 +94,32 @@ def print_code(code: list[Insn]) -> str:
 				case float(e): r = print_float(e)
 				case str(e): r = print_str(e)
 				case list(v):
-					a = "".join([print_str(line) + "\n" for line in v])
-					r = "{\n%s}" % indent(a, "\t")
+					r = "{\n%s%s}" % ("".join([ind + "\t" + print_str(line) + "\n" for line in v]), ind)
 				case AExpr(v): r = print_expr(v)
 			args.append(r)
-		s += f"{insn.name}({', '.join(args)})"
+		if newline:
+			write(ind)
+		write(f"{insn.name}({', '.join(args)})")
 		if insn.body is not None:
-			s += " " + print_code(insn.body)
-		if insn.name in ["if", "elif"] and i+1 < len(code) and code[i+1].name in ["elif", "else"]:
-			s += " "
-		else:
-			s += "\n"
-	return "{\n%s}" % indent(s, "\t")
+			write(" ")
+			write_code(insn.body, write, depth + 1)
+		newline = not (insn.name in ["if", "elif"] and i+1 < len(code) and code[i+1].name in ["elif", "else"])
+		write("\n" if newline else " ")
+	write(ind[:-1] + "}")
 
 def print_ys7_scp(scp: Ys7Scp) -> str:
-	s = ""
-	s += f"version {scp.version}\n"
-	s += f"hash {print_str(scp.hash.hex().upper())}\n"
+	f = io.StringIO()
+	write_ys7_scp(scp, f)
+	return f.getvalue()
+
+def write_ys7_scp(scp: Ys7Scp, file: T.TextIO | T.BinaryIO) -> None:
+	if isinstance(file, io.TextIOBase):
+		write = file.write
+	else:
+		write = lambda s: file.write(s.encode("utf8"))
+
+	write(f"version {scp.version}\n")
+	write(f"hash {print_str(scp.hash.hex().upper())}\n")
 
 	for name, code in scp.functions:
-		s += f"\nfunction {print_str(name)} {print_code(code)}\n"
-	return s
+		write(f"\nfunction {print_str(name)} {print_code(code)}\n")
@@ -2,6 +2,8 @@ from __future__ import annotations
 import typing as T
 
 import dataclasses as dc
+import functools
+import re
 import struct
 
 __all__ = ["Reader", "dump"]
@@ -9,9 +11,20 @@ __all__ = ["Reader", "dump"]
 A = T.TypeVar("A")
 R = T.TypeVar("R", bound="Reader")
 
+# Bounded, since callers may build formats like f"{n}I" from the data
+_struct = functools.lru_cache(maxsize=64)(struct.Struct)
+
+_U8,  _U16, _U32, _U64 = map(_struct, "BHIQ")
+_I8,  _I16, _I32, _I64 = map(_struct, "bhiq")
+_F32, _F64 = map(_struct, "fd")
+
+_NUL = re.compile(b"\0")
+
 @dc.dataclass(repr=False)
 class Reader:
-	data: bytes
+	# If data is a memoryview, raw fields and sub-readers are views into it
+	# rather than copies; use str(v, encoding) to decode them.
+	data: bytes | memoryview
 	pos: int = 0
 
 	def __repr__(self) -> str:
@@ -21,7 +34,7 @@ class Reader:
 	def __len__(self) -> int:
 		return len(self.data)
 
-	def __getitem__(self, n: int) -> bytes:
+	def __getitem__(self, n: int) -> bytes | memoryview:
 		v = self.data[self.pos:self.pos+n]
 		if len(v) != n:
 			raise ValueError(f"At 0x{self.pos:04x}: tried to read {n} bytes, but only {len(v)} were available")
@@ -38,12 +51,21 @@ class Reader:
 		self.pos += 1
 		return v
 
-	def zstr(self) -> bytes:
-		l = self.data[self.pos:].find(0)
-		s = self.data[self.pos:self.pos+l]
-		self.pos += l + 1
+	def zstr(self) -> bytes | memoryview:
+		m = _NUL.search(self.data, self.pos)
+		if m is None:
+			raise ValueError(f"At 0x{self.pos:04x}: unterminated string")
+		s = self.data[self.pos:m.start()]
+		self.pos = m.end()
 		return s
 
+	def zstrs(self, n: int) -> list[bytes]:
+		*strs, rest = bytes(self.data[self.pos:]).split(b"\0", n)
+		if len(strs) != n:
+			raise ValueError(f"At 0x{self.pos:04x}: tried to read {n} strings, but only {len(strs)} were available")
+		self.pos = len(self.data) - len(rest)
+		return strs
+
 	@property
 	def remaining(self) -> int:
 		return len(self.data) - self.pos
@@ -57,22 +79,30 @@ class Reader:
 		return dc.replace(self, pos = 0, data = data)
 
 	def unpack(self, spec: str) -> tuple[T.Any, ...]:
-		return struct.unpack(spec, self[struct.calcsize(spec)])
+		return self.unpack_struct(_struct(spec))
+
+	def unpack_struct(self, s: struct.Struct) -> tuple[T.Any, ...]:
+		pos = self.pos
+		end = pos + s.size
+		if end > len(self.data):
+			raise ValueError(f"At 0x{pos:04x}: tried to read {s.size} bytes, but only {max(len(self.data) - pos, 0)} were available")
+		self.pos = end
+		return s.unpack_from(self.data, pos)
 
-	def u8 (self) -> int: return self.unpack("B")[0]
-	def u16(self) -> int: return self.unpack("H")[0]
-	def u32(self) -> int: return self.unpack("I")[0]
-	def u64(self) -> int: return self.unpack("Q")[0]
+	def u8 (self) -> int: return self.unpack_struct(_U8)[0]
+	def u16(self) -> int: return self.unpack_struct(_U16)[0]
+	def u32(self) -> int: return self.unpack_struct(_U32)[0]
+	def u64(self) -> int: return self.unpack_struct(_U64)[0]
 
-	def i8 (self) -> int: return self.unpack("b")[0]
-	def i16(self) -> int: return self.unpack("h")[0]
-	def i32(self) -> int: return self.unpack("i")[0]
-	def i64(self) -> int: return self.unpack("q")[0]
+	def i8 (self) -> int: return self.unpack_struct(_I8)[0]
+	def i16(self) -> int: return self.unpack_struct(_I16)[0]
+	def i32(self) -> int: return self.unpack_struct(_I32)[0]
+	def i64(self) -> int: return self.unpack_struct(_I64)[0]
 
-	def f32(self) -> float: return self.unpack("f")[0]
-	def f64(self) -> float: return self.unpack("d")[0]
+	def f32(self) -> float: return self.unpack_struct(_F32)[0]
+	def f64(self) -> float: return self.unpack_struct(_F64)[0]
 
-	def check(self, data: bytes): _check(self, lambda: self[len(data)], data)
+	def check(self, data: bytes): _check(self, lambda: bytes(self[len(data)]), data)
 
 	def check_u8 (self, v: int): _check(self, self.u8,  v)
 	def check_u16(self, v: int): _check(self, self.u16, v)
@@ -92,7 +122,6 @@ def _check(f: Reader, func: T.Callable[[], A], v: A):
 		raise ValueError(f"at {pos:X}: got {w}, expected {v}")
 
 def dump(data: bytes, width: int = 48) -> str:
-	import re
 	escape = re.compile("[\x00-\x1F\x7F\x80-\x9F�]+")
 	s = ""
 	for a in range(0, len(data), width):
@@ -121,13 +150,21 @@ class Label: pass
 
 @dc.dataclass(repr=False)
 class Writer:
+	# Writes go into a trailing bytearray; appending another writer, placing a
+	# label or delaying a thunk closes it off into the chunk list instead.
+	# Closed-off bytearrays are never written to again, so appending a writer
+	# only copies its chunk list, not its bytes; later writes to it don't
+	# affect the writers it was appended to. Everything is laid out by
+	# __bytes__.
+	chunks: list[bytearray | list[T.Any] | Label | tuple[int, T.Callable[[Writer], bytes]]]
 	data: bytearray
-	thunks: dict[int, tuple[int, T.Callable[[Writer], bytes]]]
+	size: int
 	labels: dict[Label, int]
 
 	def __init__(self, data: bytes = b""):
+		self.chunks = []
 		self.data = bytearray(data)
-		self.thunks = {}
+		self.size = 0
 		self.labels = {}
 
 	def __repr__(self) -> str:
@@ -135,23 +172,56 @@ class Writer:
 	__str__ = __repr__
 
 	def __len__(self) -> int:
-		return len(self.data)
+		return self.size + len(self.data)
+
+	def _close(self) -> None:
+		if self.data:
+			self.chunks.append(self.data)
+			self.size += len(self.data)
+			self.data = bytearray()
+
+	def _push(self, chunk: list[T.Any] | Label | tuple[int, T.Callable[[Writer], bytes]], size: int) -> None:
+		self._close()
+		self.chunks.append(chunk)
+		self.size += size
 
 	def __bytes__(self) -> bytes:
-		for pos, (n, thunk) in self.thunks.items():
+		if not self.chunks:
+			return bytes(self.data)
+		out = bytearray()
+		labels = {}
+		thunks = []
+		stack = [iter([*self.chunks, self.data])]
+		while stack:
+			for chunk in stack[-1]:
+				if type(chunk) is bytearray:
+					out += chunk
+				elif type(chunk) is list:
+					stack.append(iter(chunk))
+					break
+				elif isinstance(chunk, Label):
+					labels[chunk] = len(out)
+				else:
+					n, thunk = chunk
+					thunks.append((len(out), n, thunk))
+					out += bytes(n)
+			else:
+				stack.pop()
+
+		self.labels = labels
+		for pos, n, thunk in thunks:
 			b = thunk(self)
 			assert len(b) == n, (b, n)
-			self.data[pos:pos+n] = b
-		self.thunks.clear()
-		return bytes(self.data)
+			out[pos:pos+n] = b
+		return bytes(out)
 
 	def write(self, v: bytes) -> None:
 		self.data += v
 
 	def __iadd__(self, v: Writer) -> Writer:
-		self.thunks.update((k + len(self.data), v) for k, v in v.thunks.items())
-		self.labels.update((k, v + len(self.data)) for k, v in v.labels.items())
-		self.data += v.data
+		v._close()
+		if v.chunks:
+			self._push(list(v.chunks), v.size)
 		return self
 
 	def __add__(self, v: Writer) -> Writer:
@@ -163,34 +233,30 @@ class Writer:
 	def __getitem__(self, label: Label) -> int:
 		return self.labels[label]
 
-	def __setitem__(self, label: Label, pos: int) -> None:
-		self.labels[label] = pos
-
 	def place(self, label: Label) -> Label:
-		self[label] = len(self)
+		self._push(label, 0)
 		return label
 
 	def pack(self, spec: str, *args: T.Any) -> None:
-		self.write(struct.pack(spec, *args))
+		self.data += _struct(spec).pack(*args)
 
 	def delay(self, n: int, thunk: T.Callable[[Writer], bytes]) -> None:
-		self.thunks[len(self.data)] = (n, thunk)
-		self.write(bytes(n))
+		self._push((n, thunk), n)
 
 	def diff(self, width: int, a: Label, b: Label, offset: int = 0) -> None:
 		self.delay(width, lambda r: int.to_bytes(r[b] - r[a] + offset, width, "little", signed = True))
 
-	def u8 (self, v: int) -> None: self.pack("B", v)
-	def u16(self, v: int) -> None: self.pack("H", v)
-	def u32(self, v: int) -> None: self.pack("I", v)
-	def u64(self, v: int) -> None: self.pack("Q", v)
+	def u8 (self, v: int) -> None: self.data += _U8.pack(v)
+	def u16(self, v: int) -> None: self.data += _U16.pack(v)
+	def u32(self, v: int) -> None: self.data += _U32.pack(v)
+	def u64(self, v: int) -> None: self.data += _U64.pack(v)
 
-	def i8 (self, v: int) -> None: self.pack("b", v)
-	def i16(self, v: int) -> None: self.pack("h", v)
-	def i32(self, v: int) -> None: self.pack("i", v)
-	def i64(self, v: int) -> None: self.pack("q", v)
+	def i8 (self, v: int) -> None: self.data += _I8.pack(v)
+	def i16(self, v: int) -> None: self.data += _I16.pack(v)
+	def i32(self, v: int) -> None: self.data += _I32.pack(v)
+	def i64(self, v: int) -> None: self.data += _I64.pack(v)
 
-	def f32(self, v: float) -> None: self.pack("f", v)
-	def f64(self, v: float) -> None: self.pack("d", v)
+	def f32(self, v: float) -> None: self.data += _F32.pack(v)
+	def f64(self, v: float) -> None: self.data += _F64.pack(v)
 
 	def pad(self, n: int) -> None: self.write(bytes(-len(self) % n))
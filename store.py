@@ -0,0 +1,181 @@
+from __future__ import annotations
+import dataclasses as dc
+from array import array
+
+from common import Insn, Arg, AExpr, Ys7Scp
+import print_bin
+
+__all__ = ["StringPool", "InsnStore"]
+
+# A columnar representation of decoded scripts, for keeping a whole game's
+# worth of code in memory. Each instruction is one row across the insn_*
+# arrays; the children of a body are stored contiguously, so a body is just a
+# range of rows. Arguments are rows of arg_kind/arg_value, expressions are
+# kept in their encoded form, and strings go in a pool that can be shared
+# between stores.
+
+INT, FLOAT, STR, EXPR, LIST = range(5)
+
+@dc.dataclass(repr=False)
+class StringPool:
+	strings: list[str] = dc.field(default_factory=list)
+	index: dict[str, int] = dc.field(default_factory=dict)
+
+	def __repr__(self) -> str:
+		return f"{type(self).__name__}({len(self.strings)})"
+
+	def __len__(self) -> int:
+		return len(self.strings)
+
+	def __getitem__(self, i: int) -> str:
+		return self.strings[i]
+
+	def intern(self, s: str) -> int:
+		i = self.index.get(s)
+		if i is None:
+			i = self.index[s] = len(self.strings)
+			self.strings.append(s)
+		return i
+
+@dc.dataclass(repr=False, eq=False)
+class InsnStore:
+	version: int
+	hash: bytes # length 8
+	pool: StringPool = dc.field(default_factory=StringPool)
+	functions: list[tuple[str, int, int]] = dc.field(default_factory=list)
+
+	insn_name: array[int] = dc.field(default_factory=lambda: array("I"))
+	insn_parent: array[int] = dc.field(default_factory=lambda: array("i"))
+	insn_args: array[int] = dc.field(default_factory=lambda: array("I"))
+	body_start: array[int] = dc.field(default_factory=lambda: array("i"))
+	body_end: array[int] = dc.field(default_factory=lambda: array("i"))
+
+	# For LIST, the value is the number of elements, which follow it
+	arg_kind: array[int] = dc.field(default_factory=lambda: array("B"))
+	arg_value: array[int] = dc.field(default_factory=lambda: array("q"))
+	floats: array[float] = dc.field(default_factory=lambda: array("d"))
+	exprs: bytearray = dc.field(default_factory=bytearray)
+	expr_start: array[int] = dc.field(default_factory=lambda: array("I"))
+
+	def __repr__(self) -> str:
+		return f"{type(self).__name__}({len(self.functions)} functions, {len(self)} insns)"
+
+	def __len__(self) -> int:
+		return len(self.insn_name)
+
+	def add_function(self, name: str, code: list[Insn]) -> None:
+		start = len(self)
+		self._add_block(code, -1)
+		self.functions.append((name, start, start + len(code)))
+
+		queue = [start + i for i, insn in enumerate(code) if insn.body is not None]
+		bodies = [insn.body for insn in code if insn.body is not None]
+		while queue:
+			next_queue, next_bodies = [], []
+			for parent, body in zip(queue, bodies):
+				start = len(self)
+				self._add_block(body, parent)
+				self.body_start[parent] = start
+				self.body_end[parent] = start + len(body)
+				for i, insn in enumerate(body):
+					if insn.body is not None:
+						next_queue.append(start + i)
+						next_bodies.append(insn.body)
+			queue, bodies = next_queue, next_bodies
+
+	def _add_block(self, code: list[Insn], parent: int) -> None:
+		for insn in code:
+			self.insn_name.append(self.pool.intern(insn.name))
+			self.insn_parent.append(parent)
+			self.insn_args.append(len(self.arg_kind))
+			self.body_start.append(-1)
+			self.body_end.append(-1)
+			for arg in insn.args:
+				self._add_arg(arg)
+
+	def _add_arg(self, arg: Arg) -> None:
+		match arg:
+			case int(v):
+				self.arg_kind.append(INT)
+				self.arg_value.append(v)
+			case float(v):
+				self.arg_kind.append(FLOAT)
+				self.arg_value.append(len(self.floats))
+				self.floats.append(v)
+			case str(v):
+				self.arg_kind.append(STR)
+				self.arg_value.append(self.pool.intern(v))
+			case AExpr():
+				self.arg_kind.append(EXPR)
+				self.arg_value.append(len(self.expr_start))
+				self.expr_start.append(len(self.exprs))
+				self.exprs += arg.raw if arg.raw is not None else print_bin.write_expr(arg.expr)
+			case list(v):
+				self.arg_kind.append(LIST)
+				self.arg_value.append(len(v))
+				for a in v:
+					self._add_arg(a)
+			case _: raise ValueError(arg)
+
+	def name(self, i: int) -> str:
+		return self.pool[self.insn_name[i]]
+
+	def parent(self, i: int) -> int | None:
+		p = self.insn_parent[i]
+		return p if p >= 0 else None
+
+	def body(self, i: int) -> range | None:
+		if self.body_start[i] < 0:
+			return None
+		return range(self.body_start[i], self.body_end[i])
+
+	def args(self, i: int) -> list[Arg]:
+		end = self.insn_args[i+1] if i+1 < len(self) else len(self.arg_kind)
+		pos = self.insn_args[i]
+		args = []
+		while pos < end:
+			arg, pos = self._arg(pos)
+			args.append(arg)
+		return args
+
+	def _arg(self, pos: int) -> tuple[Arg, int]:
+		kind, v = self.arg_kind[pos], self.arg_value[pos]
+		pos += 1
+		if kind == INT:
+			return v, pos
+		if kind == FLOAT:
+			return self.floats[v], pos
+		if kind == STR:
+			return self.pool[v], pos
+		if kind == EXPR:
+			end = self.expr_start[v+1] if v+1 < len(self.expr_start) else len(self.exprs)
+			return AExpr.from_bytes(bytes(self.exprs[self.expr_start[v]:end])), pos
+		if kind == LIST:
+			out = []
+			for _ in range(v):
+				a, pos = self._arg(pos)
+				out.append(a)
+			return out, pos
+		raise ValueError(kind)
+
+	def indices(self, name: str) -> list[int]:
+		if name not in self.pool.index:
+			return []
+		n = self.pool.index[name]
+		return [i for i, v in enumerate(self.insn_name) if v == n]
+
+	def insn(self, i: int) -> Insn:
+		body = self.body(i)
+		return Insn(self.name(i), self.args(i), [self.insn(j) for j in body] if body is not None else None)
+
+	def function(self, name: str) -> list[Insn]:
+		for fname, start, end in self.functions:
+			if fname == name:
+				return [self.insn(i) for i in range(start, end)]
+		raise KeyError(name)
+
+	def load(self) -> Ys7Scp:
+		return Ys7Scp(self.version, self.hash, [
+			(name, [self.insn(i) for i in range(start, end)])
+			for name, start, end in self.functions
+		])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+import typing as T
+import argparse
+import dataclasses as dc
+import random
+import struct
+from pathlib import Path
+
+from common import insn_tables, Insn, Expr, Arg, Binop, Unop, Call, Index, AExpr, Ys7Scp
+import parse_bin
+
+__all__ = ["Params", "generate", "write_corpus"]
+
+# Generates random but valid scripts, for benchmarking without game files.
+# Only forms that survive a round trip through .7l unchanged are produced, so
+# the .bin and .7l outputs are equivalent.
+
+@dc.dataclass
+class Params:
+	version: int = 16
+	functions: int = 50
+	statements: int = 20 # per block at the top level, fewer further in
+	depth: int = 4
+	expr_density: float = 0.3 # fraction of arguments that are expressions
+	message_density: float = 0.1 # fraction of statements that are messages
+	string_density: float = 0.2 # fraction of arguments that are strings
+
+binops = ["|", "||", "&", "&&", "==", "!=", "<", ">", "<=", ">=", "+", "-", "*", "/", "%"]
+indices = sorted({ v[1] for v in parse_bin.expr.values() if v[0] == "index" })
+funcs = sorted({ v[1:] for v in parse_bin.expr.values() if v[0] == "func" and len(v) == 3 })
+
+words = ["Adol", "Dogi", "ship", "sword", "\"quoted\"", "ruins", "アドル", "ドギ", "cave", "key"]
+
+structural = {
+	"if", "elif", "else", "while", "switch", "switch9", "case", "default", "case9", "default9",
+	"goto", "break", "endif", "return", "ExecuteCmd",
+	"Message", "OpenMessage", "Message2", "YesNoMenu", "GetItemMessageExPlus", "NoiSystemMessage",
+}
+
+class Generator:
+	def __init__(self, params: Params, seed: int | str):
+		self.p = params
+		self.r = random.Random(seed)
+		table = insn_tables[params.version]
+		self.names = sorted(v for v in table.values() if v not in structural and v.isidentifier())
+		self.messages = [v for v in ["Message", "OpenMessage", "Message2", "YesNoMenu"] if v in table.values()]
+		self.switch9 = "switch9" in table.values()
+
+	def text(self) -> str:
+		return " ".join(self.r.choices(words, k=self.r.randrange(1, 6)))
+
+	def f32(self) -> float:
+		# An f32 with a fractional part, since integral floats print as ints
+		while True:
+			v = struct.unpack("f", struct.pack("f", round(self.r.uniform(-1000, 1000), self.r.randrange(1, 4))))[0]
+			if v != int(v):
+				return v
+
+	def expr(self, depth: int = 0) -> Expr:
+		r = self.r
+		match r.randrange(8 if depth < 3 else 3):
+			case 0: return r.randrange(-1000, 10000)
+			case 1: return self.f32()
+			case 2: return Index(r.choice(indices), r.randrange(256))
+			case 3 | 4 | 5: return Binop(self.expr(depth+1), r.choice(binops), self.expr(depth+1))
+			case 6: return Unop(r.choice("!-"), Index(r.choice(indices), self.expr(depth+1)))
+			case _:
+				name, n = r.choice(funcs)
+				return Call(name, [self.expr(depth+1) for _ in range(n)])
+
+	def arg(self) -> Arg:
+		r = self.r.random()
+		if r < self.p.expr_density:
+			return AExpr(self.expr())
+		r -= self.p.expr_density
+		if r < self.p.string_density:
+			return self.text()
+		return self.f32() if self.r.random() < 0.2 else self.r.randrange(-100, 10000)
+
+	def lines(self) -> list[str]:
+		return [self.text() for _ in range(self.r.randrange(1, 4))]
+
+	def message(self) -> Insn:
+		match self.r.choice(self.messages):
+			case "Message": return Insn("Message", [self.r.randrange(100), self.lines()])
+			case "OpenMessage": return Insn("OpenMessage", [self.r.randrange(100), self.lines()])
+			case "Message2": return Insn("Message2", [self.r.randrange(100), 0, 0, self.lines()])
+			case "YesNoMenu": return Insn("YesNoMenu", [self.r.randrange(100), self.lines(), 0])
+			case name: raise ValueError(name)
+
+	def plain(self) -> Insn:
+		return Insn(self.r.choice(self.names), [self.arg() for _ in range(self.r.randrange(5))])
+
+	def block(self, depth: int) -> list[Insn]:
+		r = self.r
+		n = max(1, self.p.statements >> depth)
+		code = []
+		for _ in range(r.randrange(1, n + 1)):
+			k = r.random()
+			if k < self.p.message_density:
+				code.append(self.message())
+			elif depth >= self.p.depth or k < 0.7:
+				code.append(self.plain())
+			elif k < 0.8:
+				code.append(Insn("if", [AExpr(self.expr())], self.block(depth+1)))
+				if r.random() < 0.4:
+					code.append(Insn("elif", [AExpr(self.expr())], self.block(depth+1)))
+				if r.random() < 0.4:
+					code.append(Insn("else", [], self.block(depth+1)))
+			elif k < 0.9:
+				body = self.block(depth+1)
+				body.insert(0, Insn("if", [AExpr(self.expr())], [Insn("break", [])]))
+				code.append(Insn("while", [AExpr(self.expr())], body))
+			else:
+				code.append(self.switch(depth))
+		return code
+
+	def switch(self, depth: int) -> Insn:
+		cases = []
+		for value in self.r.sample(range(32), self.r.randrange(1, 5)):
+			cases.append(Insn("case", [value], self.block(depth+1) + [Insn("break", [])]))
+		# Ys IX's switch always has a default; the compiler adds one if it's missing
+		if self.switch9 or self.r.random() < 0.5:
+			cases.append(Insn("default", [], self.block(depth+1) + [Insn("break", [])]))
+		return Insn("switch", [AExpr(Index("WORK", self.r.randrange(256)))], cases)
+
+	def function(self) -> list[Insn]:
+		code = self.block(0)
+		if code[-1].body is not None:
+			code.append(self.plain())
+		return code
+
+def generate(params: Params, seed: int | str = 0) -> Ys7Scp:
+	g = Generator(params, seed)
+	hash = bytes(g.r.randrange(256) for _ in range(8))
+	return Ys7Scp(params.version, hash, [(f"func_{i:04}", g.function()) for i in range(params.functions)])
+
+def write_corpus(params: Params, output: Path, files: int, seed: int = 0) -> list[Path]:
+	import print_bin, print_text
+	output.mkdir(parents=True, exist_ok=True)
+	out = []
+	for i in range(files):
+		path = output / f"synth{params.version}_{seed}_{i:03}.bin"
+		data = print_bin.write_ys7_scp(generate(params, f"{seed}:{i}"))
+		path.write_bytes(data)
+		with path.with_suffix(".7l").open("w", encoding="utf8", newline="") as f:
+			print_text.write_ys7_scp(parse_bin.parse_ys7_scp(data), f)
+		out.append(path)
+	return out
+
+argp = argparse.ArgumentParser(description="generate synthetic .bin and .7l scripts for benchmarking")
+argp.add_argument("-o", "--output", help="directory to place files in", type = Path, default = Path("synth"))
+argp.add_argument("-n", "--files", help="number of scripts to generate", type = int, default = 1)
+argp.add_argument("-s", "--seed", help="random seed; the same seed and options give the same files", type = int, default = 0)
+argp.add_argument("-v", "--version", help="script version: 2 (Nayuta), 6 (Ys VIII) or 16 (Ys IX)", type = int, choices = sorted(insn_tables), default = Params.version)
+argp.add_argument("--functions", help="functions per script", type = int, default = Params.functions)
+argp.add_argument("--statements", help="maximum statements per top-level block, halved at each nesting level", type = int, default = Params.statements)
+argp.add_argument("--depth", help="maximum nesting depth", type = int, default = Params.depth)
+argp.add_argument("--expr-density", help="fraction of arguments that are expressions", type = float, default = Params.expr_density)
+argp.add_argument("--message-density", help="fraction of statements that are messages", type = float, default = Params.message_density)
+argp.add_argument("--string-density", help="fraction of arguments that are strings", type = float, default = Params.string_density)
+
+def __main__(output: Path, files: int, seed: int, **params: T.Any) -> None:
+	for path in write_corpus(Params(**params), output, files, seed):
+		print(f"{path} ({path.stat().st_size} bytes)")
+
+if __name__ == "__main__":
+	__main__(**argp.parse_args().__dict__)
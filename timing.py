@@ -0,0 +1,83 @@
+from __future__ import annotations
+import typing as T
+import dataclasses as dc
+import contextlib
+import cProfile
+import marshal
+import time
+import tracemalloc
+from pathlib import Path
+
+__all__ = ["FileProfile", "report"]
+
+# Per-stage wall time and allocation for main.py's --profile. Allocation is the
+# peak traced by tracemalloc during the stage, above what was allocated when
+# it started; tracing slows everything down, so times are only comparable
+# between profiled runs.
+
+@dc.dataclass
+class FileProfile:
+	file: Path
+	outfile: Path | None = None
+	stages: dict[str, tuple[float, int]] = dc.field(default_factory=dict)
+	total: float = 0
+	stats: dict[T.Any, T.Any] | None = None # in the form pstats reads
+
+	@contextlib.contextmanager
+	def stage(self, name: str) -> T.Iterator[None]:
+		base = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			seconds = time.perf_counter() - start
+			peak = tracemalloc.get_traced_memory()[1] - base
+			prev_seconds, prev_peak = self.stages.get(name, (0, 0))
+			self.stages[name] = (prev_seconds + seconds, max(prev_peak, peak))
+
+	@contextlib.contextmanager
+	def run(self, cprofile: bool = False) -> T.Iterator[None]:
+		tracing = tracemalloc.is_tracing()
+		if not tracing:
+			tracemalloc.start()
+		profiler = cProfile.Profile() if cprofile else None
+		start = time.perf_counter()
+		try:
+			if profiler is not None:
+				profiler.enable()
+			yield
+		finally:
+			if profiler is not None:
+				profiler.disable()
+			self.total = time.perf_counter() - start
+			if not tracing:
+				tracemalloc.stop()
+			if profiler is not None:
+				profiler.create_stats()
+				self.stats = profiler.stats # type: ignore
+
+	def dump_stats(self, path: Path) -> None:
+		assert self.stats is not None
+		path.write_bytes(marshal.dumps(self.stats))
+
+def report(profiles: list[FileProfile]) -> str:
+	names = list(dict.fromkeys(name for p in profiles for name in p.stages))
+	width = max([len(str(p.file)) for p in profiles] + [5])
+	lines = [f"{'file':{width}} " + " ".join(f"{name:>20}" for name in names) + f" {'total':>9}"]
+	for p in sorted(profiles, key=lambda p: -p.total):
+		cells = []
+		for name in names:
+			if name in p.stages:
+				seconds, peak = p.stages[name]
+				cells.append(f"{seconds*1e3:8.1f}ms {peak/2**20:6.1f}MiB")
+			else:
+				cells.append(f"{'':20}")
+		lines.append(f"{str(p.file):{width}} " + " ".join(cells) + f" {p.total*1e3:7.1f}ms")
+	cells = []
+	for name in names:
+		seconds = sum(p.stages[name][0] for p in profiles if name in p.stages)
+		peak = max(p.stages[name][1] for p in profiles if name in p.stages)
+		cells.append(f"{seconds*1e3:8.1f}ms {peak/2**20:6.1f}MiB")
+	lines.append(f"{'total':{width}} " + " ".join(cells) + f" {sum(p.total for p in profiles)*1e3:7.1f}ms")
+	return "\n".join(lines)